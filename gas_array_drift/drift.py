@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streaming pass over the gas batches 1 -> 10 in time order for drift studies.
+# Only the current batch is in memory: the normalization is updated with
+# partial_fit after every batch, and the drift of every batch is measured
+# against running statistics of all the batches before it (cumulative) and
+# of the last few batches (sliding window). Every batch is evaluated before
+# it updates the state (test-then-train), by default with a nearest centroid
+# classifier on the normalized samples.
+
+import argparse
+import json
+from collections import deque
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler, MinMaxScaler
+
+from read_gas import batch_files, read_gas_data, cat_cnt
+
+
+class RunningStats:
+	"""
+	Count, mean and variance per feature, updated batch by batch
+
+	Args:
+		num_features: number of features
+	"""
+
+	def __init__(self, num_features):
+		self.count = 0
+		self.mean = np.zeros(num_features)
+		self.m2 = np.zeros(num_features)  # sum of squared deviations
+
+	@classmethod
+	def of(cls, x):
+		stats = cls(x.shape[1])
+		stats.count = x.shape[0]
+		stats.mean = x.mean(axis=0)
+		stats.m2 = ((x - stats.mean) ** 2).sum(axis=0)
+		return stats
+
+	def merge(self, other):
+		"""Add the samples summarized by other, (Chan et al.)"""
+		count = self.count + other.count
+		if other.count == 0:
+			return self
+		delta = other.mean - self.mean
+		self.mean = self.mean + delta * other.count / count
+		self.m2 = self.m2 + other.m2 + \
+			delta ** 2 * self.count * other.count / count
+		self.count = count
+		return self
+
+	@property
+	def std(self):
+		return np.sqrt(self.m2 / max(self.count, 1))
+
+
+class StreamingRobustScaler:
+	"""
+	RobustScaler with partial_fit: the median and interquartile range are
+	taken on a uniform sample of at most max_samples of the samples seen so
+	far (reservoir sampling), so the memory stays bounded
+
+	Args:
+		quantile_range: quantiles of the range to scale by, as RobustScaler
+		max_samples: size of the reservoir
+		seed: seed of the sampling
+	"""
+
+	def __init__(self, quantile_range=(25.0, 75.0), max_samples=4096, seed=0):
+		self.quantile_range = quantile_range
+		self.max_samples = max_samples
+		self.rng = np.random.default_rng(seed)
+		self.reservoir = None
+		self.n_samples_seen_ = 0
+
+	def partial_fit(self, x):
+		x = np.asarray(x, dtype=float)
+		if self.reservoir is None:
+			self.reservoir = np.empty((self.max_samples, x.shape[1]))
+		# fill the reservoir, then keep the i-th sample with prob. size/i
+		fill = min(max(self.max_samples - self.n_samples_seen_, 0), len(x))
+		self.reservoir[self.n_samples_seen_:self.n_samples_seen_ + fill] = \
+			x[:fill]
+		seen = self.n_samples_seen_ + np.arange(fill, len(x))
+		slots = (self.rng.random(len(seen)) * (seen + 1)).astype(np.int64)
+		for i in np.flatnonzero(slots < self.max_samples):
+			self.reservoir[slots[i]] = x[fill + i]
+		self.n_samples_seen_ += len(x)
+
+		sample = self.reservoir[:min(self.n_samples_seen_, self.max_samples)]
+		self.center_ = np.median(sample, axis=0)
+		low, high = np.percentile(sample, self.quantile_range, axis=0)
+		self.scale_ = high - low
+		self.scale_[self.scale_ == 0] = 1.0  # constant features, as sklearn
+		return self
+
+	def transform(self, x):
+		return (np.asarray(x, dtype=float) - self.center_) / self.scale_
+
+	def fit_transform(self, x):
+		return self.partial_fit(x).transform(x)
+
+
+def incremental_scaler(scaler_name='Standard'):
+	"""Scaler with partial_fit for the names of read_gas.normalize_data"""
+	if scaler_name == 'Robust':
+		return StreamingRobustScaler()
+
+	elif scaler_name == 'Standard':
+		return StandardScaler()
+
+	elif scaler_name == 'MinMax':
+		return MinMaxScaler(feature_range=(0, 1))
+
+	raise ValueError('Unknown scaler {}'.format(scaler_name))
+
+
+def drift_stats(batch, ref):
+	"""
+	Drift of the samples of a batch from reference statistics
+
+	Args:
+		batch: RunningStats of the batch
+		ref: RunningStats of the reference samples
+	Returns:
+		stats: dictionary of the mean over features of the shift of the mean
+			in reference std, the largest shift and its feature, and the mean
+			over features of the std ratio to the reference, None without
+			reference
+	"""
+	if ref.count == 0:
+		return None
+	ref_std = np.where(ref.std > 0, ref.std, 1.0)
+	shift = np.abs(batch.mean - ref.mean) / ref_std
+	return {'mean_shift': float(shift.mean()),
+			'max_shift': float(shift.max()),
+			'max_shift_feature': int(shift.argmax()),
+			'std_ratio': float(np.mean(batch.std / ref_std))}
+
+
+class DriftPipeline:
+	"""
+	Normalize, measure and evaluate the batches one at a time, in time order
+
+	Args:
+		scaler_name: 'Standard', 'MinMax' or 'Robust'
+		window: number of previous batches of the sliding window statistics
+		evaluate: function(x, y) of a normalized batch returning a dictionary
+			of metrics, called before the batch updates the state, the
+			nearest centroid accuracy if None
+	"""
+
+	def __init__(self, scaler_name='Standard', window=3, evaluate=None):
+		self.scaler = incremental_scaler(scaler_name)
+		self.window = deque(maxlen=window)
+		self.cumulative = None
+		self.evaluate = evaluate or self.centroid_accuracy
+		self.class_sum = None
+		self.class_count = np.zeros(cat_cnt)
+
+	def centroid_accuracy(self, x, y):
+		"""Accuracy of the nearest class mean of the previous batches,
+		normalized with the current scaler"""
+		seen = self.class_count > 0
+		centroids = self.scaler.transform(
+			self.class_sum[seen] / self.class_count[seen, None])
+		dist = ((x[:, None, :] - centroids[None]) ** 2).sum(axis=-1)
+		y_hat = np.flatnonzero(seen)[dist.argmin(axis=1)]
+		return {'accuracy': float(np.mean(y_hat == y))}
+
+	def step(self, x, y):
+		"""
+		Measure and evaluate a batch, then update the state with it
+
+		Args:
+			x: samples, (num_samples, num_features)
+			y: labels, (num_samples,)
+		Returns:
+			record: dictionary of the drift statistics and the metrics
+		"""
+		x = np.asarray(x, dtype=float)
+		if self.cumulative is None:
+			self.cumulative = RunningStats(x.shape[1])
+			self.class_sum = np.zeros((cat_cnt, x.shape[1]))
+
+		batch = RunningStats.of(x)
+		window = RunningStats(x.shape[1])
+		for stats in self.window:
+			window.merge(stats)
+		record = {'num_samples': len(x),
+				  'cumulative': drift_stats(batch, self.cumulative),
+				  'window': drift_stats(batch, window)}
+		if self.cumulative.count > 0:
+			record.update(self.evaluate(self.scaler.transform(x), y))
+
+		self.scaler.partial_fit(x)
+		self.cumulative.merge(batch)
+		self.window.append(batch)
+		np.add.at(self.class_sum, y, x)
+		self.class_count += np.bincount(y, minlength=cat_cnt)
+		return record
+
+	def run(self, filenames, cache_dir=None):
+		"""
+		Go through batch files in order, reading one at a time
+
+		Yields:
+			record: the record of every batch, with its file name
+		"""
+		for filename in filenames:
+			x, y = read_gas_data(filename, cache_dir)
+			yield dict(self.step(x, y), file=filename)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--folder', type=str, default='.',
+						help='folder of batch1.dat ... batch10.dat')
+	parser.add_argument('--scaler', type=str, default='Standard',
+						choices=['Standard', 'MinMax', 'Robust'],
+						help='normalization updated after every batch')
+	parser.add_argument('--window', type=int, default=3,
+						help='number of previous batches of the sliding '
+							 'window statistics')
+	parser.add_argument('--cache', type=str, default=None,
+						help='folder to keep the parsed batches in, none if '
+							 'not given')
+	parser.add_argument('--report', type=str, default='drift.json',
+						help='json file of the records of every batch')
+	args = parser.parse_args()
+
+	pipeline = DriftPipeline(args.scaler, args.window)
+	print('{:<14}{:>8}{:>12}{:>12}{:>12}{:>12}{:>10}'.format(
+		'batch', 'samples', 'cum shift', 'cum std', 'win shift', 'win std',
+		'accuracy'))
+	records = []
+	for record in pipeline.run(batch_files(args.folder), args.cache):
+		records.append(record)
+		cells = []
+		for key in ['cumulative', 'window']:
+			stats = record[key]
+			cells += ['-', '-'] if stats is None else [
+				'{:.3f}'.format(stats['mean_shift']),
+				'{:.3f}'.format(stats['std_ratio'])]
+		print('{:<14}{:>8}{:>12}{:>12}{:>12}{:>12}{:>10}'.format(
+			record['file'].split('/')[-1], record['num_samples'], *cells,
+			'{:.3f}'.format(record['accuracy']) if 'accuracy' in record
+			else '-'))
+
+	with open(args.report, 'w') as fp:
+		json.dump({'config': vars(args), 'records': records}, fp, indent=4)
+	print('Report saved to {}'.format(args.report))
+
+
+if __name__ == '__main__':
+	main()
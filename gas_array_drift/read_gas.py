@@ -1,27 +1,190 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 import matplotlib.pyplot as plt
 
+# scatter_report.py of the parent folder is shared with isolet/read_data.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								os.pardir))
+from scatter_report import finish_figure, render_report, scatter_classes
+
 ###############################################
 # Data import functions
 ###############################################
-def read_gas_data(filename):
-	x, y = [], []
+def parse_gas_data(filename, num_features=None, dtype=np.float64):
+	"""
+	Parse a batch file in the SVMlight format, 'label idx:value ...' per
+	line, in bulk into a preallocated array
+
+	The label may carry the concentration as 'label;concentration', which is
+	dropped. Features missing from a line are 0, as in the SVMlight format.
+
+	Args:
+		filename: path of the batch file, e.g., batch1.dat
+		num_features: number of features, the largest index if None
+		dtype: dtype of the samples
+	Returns:
+		x: samples, (num_samples, num_features)
+		y: labels starting from 0, (num_samples,)
+	"""
 	with open(filename, 'r') as f:
-		lines = f.readlines()
-		for line in lines:
-			data = line.strip().split()
-			new_y = int(data[0]) - 1
-			new_x = [float(d.split(':')[1]) for d in data[1:]]
-			y.append(new_y)
-			x.append(new_x)
-
-	x, y = np.array(x), np.array(y)
+		rows = [line.split(None, 1) for line in f if line.strip()]
+
+	y = np.array([r[0].split(';')[0] for r in rows], dtype=float)
+	y = y.astype(np.int64) - 1
+	feats = [r[1] if len(r) > 1 else '' for r in rows]
+	counts = np.array([s.count(':') for s in feats])
+	# all 'idx:value' pairs of the file parsed by numpy in one call
+	pairs = np.fromstring(' '.join(feats).replace(':', ' '), sep=' ')
+	if pairs.size != 2 * counts.sum():
+		raise ValueError('{}: malformed idx:value pairs'.format(filename))
+	idx = pairs[0::2].astype(np.int64) - 1
+	if idx.size and idx.min() < 0:
+		raise ValueError('{}: feature indices start from 1'.format(filename))
+	if num_features is None:
+		num_features = int(idx.max()) + 1 if idx.size else 0
+	elif idx.size and idx.max() >= num_features:
+		raise ValueError('{}: feature index {} beyond {} features'.format(
+			filename, int(idx.max()) + 1, num_features))
+
+	x = np.zeros((len(rows), num_features), dtype=dtype)
+	x[np.repeat(np.arange(len(rows)), counts), idx] = pairs[1::2]
 	return x, y
 
+
+def file_hash(filename):
+	"""sha1 of the content of a file"""
+	h = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+def cached_hash(filename, cache_dir):
+	"""
+	sha1 of a file, hashed again only if its size or modification time changed
+	since the last call, as recorded in cache_dir
+
+	Returns:
+		name: name of the file without extension
+		digest: the sha1 of the file
+	"""
+	name = os.path.splitext(os.path.basename(filename))[0]
+	st = os.stat(filename)
+	# one record per source file, so parallel loads of batches never share one
+	path_key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+	stat_path = os.path.join(cache_dir,
+							 '{}.{}.json'.format(name, path_key[:10]))
+	stat = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+	if os.path.exists(stat_path):
+		with open(stat_path, 'r') as f:
+			record = json.load(f)
+		if {k: record.get(k) for k in stat} == stat:
+			return name, record['sha1']
+
+	digest = file_hash(filename)
+	os.makedirs(cache_dir, exist_ok=True)
+	with open(stat_path + '.part', 'w') as f:
+		json.dump(dict(stat, sha1=digest), f)
+	os.replace(stat_path + '.part', stat_path)
+	return name, digest
+
+
+def cache_paths(filename, cache_dir, num_features=None, dtype=np.float64):
+	"""Paths of the cached samples and labels of a batch file, keyed by its
+	content, so an edited file is parsed again"""
+	name, digest = cached_hash(filename, cache_dir)
+	key = '{}.{}.{}.{}'.format(name, digest, num_features or 'all',
+							   np.dtype(dtype).name)
+	return (os.path.join(cache_dir, key + '.x.npy'),
+			os.path.join(cache_dir, key + '.y.npy'))
+
+
+def _save(path, arr):
+	# write to a temporary file first, so a cache file is always complete
+	with open(path + '.part', 'wb') as f:
+		np.save(f, arr)
+	os.replace(path + '.part', path)
+
+
+def cache_gas_data(filename, cache_dir, num_features=None, dtype=np.float64):
+	"""Parse a batch file into the cache unless already there, and return
+	the paths of its samples and labels"""
+	x_path, y_path = cache_paths(filename, cache_dir, num_features, dtype)
+	if not (os.path.exists(x_path) and os.path.exists(y_path)):
+		os.makedirs(cache_dir, exist_ok=True)
+		x, y = parse_gas_data(filename, num_features, dtype)
+		_save(x_path, x)
+		_save(y_path, y)
+	return x_path, y_path
+
+
+def read_gas_data(filename, cache_dir=None, num_features=None,
+				  dtype=np.float64, mmap=True):
+	"""
+	Read a batch file
+
+	Args:
+		filename: path of the batch file, e.g., batch1.dat
+		cache_dir: folder of the parsed batches, None to parse every time
+		num_features: number of features, the largest index if None
+		dtype: dtype of the samples
+		mmap: if True, memory map the cached arrays instead of reading them
+	Returns:
+		x: samples, (num_samples, num_features)
+		y: labels starting from 0, (num_samples,)
+	"""
+	if cache_dir is None:
+		return parse_gas_data(filename, num_features, dtype)
+	x_path, y_path = cache_gas_data(filename, cache_dir, num_features, dtype)
+	mmap_mode = 'r' if mmap else None
+	return np.load(x_path, mmap_mode=mmap_mode), \
+		np.load(y_path, mmap_mode=mmap_mode)
+
+
+def batch_files(folder='.', batches=range(1, 11)):
+	"""Paths of the batch files batch1.dat, ..., batch10.dat in folder"""
+	return [os.path.join(folder, 'batch{}.dat'.format(b)) for b in batches]
+
+
+def read_gas_batches(filenames, cache_dir=None, num_features=None,
+					 dtype=np.float64, processes=None):
+	"""
+	Read batch files in parallel, one process per file
+
+	With a cache, the processes write the parsed batches to cache_dir and the
+	batches are returned as memory maps of the cached arrays, which are not
+	copied between processes.
+
+	Args:
+		filenames: paths of the batch files, see batch_files
+		cache_dir: folder of the parsed batches, None to parse every time
+		processes: number of processes, the number of CPUs if None
+	Returns:
+		data: list of (x, y) per batch file
+	"""
+	with ProcessPoolExecutor(processes) as pool:
+		if cache_dir is None:
+			return list(pool.map(parse_gas_data, filenames,
+								 [num_features] * len(filenames),
+								 [dtype] * len(filenames)))
+		paths = list(pool.map(cache_gas_data, filenames,
+							  [cache_dir] * len(filenames),
+							  [num_features] * len(filenames),
+							  [dtype] * len(filenames)))
+	return [(np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r'))
+			for x_path, y_path in paths]
+
 def normalize_data(data, scaler_name='Standard'):
 	if scaler_name == 'Robust':
 		scaler = RobustScaler()
@@ -48,7 +211,8 @@ colors = ['tab:blue', 'tab:orange', 'tab:green', 'tab:red', 'tab:purple',
 		  'tab:brown']
 
 
-def plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
+def plot_gas_data(x, y, plot_3d=False, title='', fig_name='',
+		max_points=None, rasterized=False, dpi=300, show=True):
 	"""
 	Plot scatter plot of the first 2/3 channels of x, with diff colors
 	indicating diff classes, i.e., y
@@ -59,23 +223,17 @@ def plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
 		plot_3d: if True, plot first 3 channels, else, plot first 2 channels
 		title: title of plot, '' means no title
 		fig_name: the name of the figure to be saved, '' means do not save
+		max_points: if more samples, plot a random subset of max_points
+		rasterized: if True, draw the points as images in vector formats
+		dpi: resolution of the saved figure
+		show: if False, close the figure instead of showing it
 	"""
-	scatter_size = 20
-
 	fig = plt.figure()
 	if plot_3d:
 		ax = fig.add_subplot(111, projection='3d')  # 3-D
 	else:
 		ax = fig.add_subplot(111)  # 2-D
-	for i in range(cat_cnt):
-		mask = (y == i)
-		if plot_3d:
-			# z = np.arange(len(mask))[mask] # get the time index
-			ax.scatter(x[mask, 0], x[mask, 1], x[mask, 2], alpha=0.8,
-					   color=colors[i], s=scatter_size, label=labels[i])  # 3-D
-		else:
-			ax.scatter(x[mask, 0], x[mask, 1], alpha=0.8, color=colors[i],
-					   s=scatter_size, label=labels[i])  # 2-D
+	scatter_classes(ax, x, y, colors, labels, max_points, rasterized)
 	ax.set_xlabel('Channel 0', fontsize=15)
 	ax.set_ylabel('Channel 1', fontsize=15)
 	ax.tick_params(labelsize=15)
@@ -84,26 +242,18 @@ def plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
 	# legend = fig.legend()
 	plt.grid()
 	plt.tight_layout()
-
-	if fig_name != '':
-		plt.savefig(fig_name, dpi=300, bbox_inches='tight')
-	plt.show()
+	finish_figure(fig, fig_name, dpi, show)
 
 
-def pca_plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
+def pca_plot_gas_data(x, y, plot_3d=False, title='', fig_name='',
+		max_points=None, rasterized=False, dpi=300, show=True):
 	"""
 	Plot scatter plot of the first 2/3 channels of x after PCA,
 	with diff colors indicating diff classes, i.e., y
 
-	Args:
-		x: samples, (num_samples, num_features)
-		y: labels, (num_samples,)
-		plot_3d: if True, plot first 3 channels, else, plot first 2 channels
-		title: title of plot, '' means no title
-		fig_name: the name of the figure to be saved, '' means do not save
+	Args: as plot_gas_data
 	"""
 	from sklearn.decomposition import PCA
-	scatter_size = 20
 
 	pca = PCA(n_components=3)
 	pc_x = pca.fit_transform(x)
@@ -115,15 +265,7 @@ def pca_plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
 		ax = fig.add_subplot(111, projection='3d')  # 3-D
 	else:
 		ax = fig.add_subplot(111)
-	for i in range(cat_cnt):
-		mask = (y == i)
-		if plot_3d:
-			# z = np.arange(len(mask))[mask] # get the time index
-			ax.scatter(pc_x[mask, 0], pc_x[mask, 1], pc_x[mask, 2], alpha=0.8,
-					   color=colors[i], s=scatter_size, label=labels[i])  # 3-D
-		else:
-			ax.scatter(pc_x[mask, 0], pc_x[mask, 1], alpha=0.8, color=colors[i],
-					   s=scatter_size, label=labels[i])  # 2-D
+	scatter_classes(ax, pc_x, y, colors, labels, max_points, rasterized)
 	ax.set_xlabel('Principal Component 0', fontsize=15)
 	ax.set_ylabel('Principal Component 1', fontsize=15)
 	ax.tick_params(labelsize=15)
@@ -132,13 +274,11 @@ def pca_plot_gas_data(x, y, plot_3d=False, title='', fig_name=''):
 	legend = fig.legend()
 	plt.grid()
 	plt.tight_layout()
-
-	if fig_name != '':
-		plt.savefig(fig_name, dpi=300, bbox_inches='tight')
-	plt.show()
+	finish_figure(fig, fig_name, dpi, show)
 
 
-def plot_gas_data_compare(x, y, y_hat, title='', fig_name=''):
+def plot_gas_data_compare(x, y, y_hat, title='', fig_name='',
+		max_points=None, rasterized=False, dpi=300, show=True):
 	"""
 	Plot scatter plot of the first 2 channels of X, compare with the
 	ground-truth labels
@@ -147,17 +287,11 @@ def plot_gas_data_compare(x, y, y_hat, title='', fig_name=''):
 		x: samples, (num_samples, num_features)
 		y: ground-truth labels, (num_samples,)
 		y_hat: predicted labels, (num_sample,)
-		title: title of plot, '' means no title
-		fig_name: the name of the figure to be saved, '' means do not save
+		others: as plot_gas_data, both plots show the same subset of samples
 	"""
-	scatter_size = 20
-
 	fig = plt.figure(figsize=(9, 4))
 	ax1 = fig.add_subplot(121)  # 2-D
-	for i in range(cat_cnt):
-		mask = (y == i)
-		ax1.scatter(x[mask, 0], x[mask, 1], alpha=0.8, color=colors[i],
-					s=scatter_size, label=labels[i])  # 2-D
+	scatter_classes(ax1, x, y, colors, labels, max_points, rasterized)
 	ax1.set_xlabel('Channel 0', fontsize=15)
 	ax1.set_ylabel('Channel 1', fontsize=15)
 	ax1.tick_params(labelsize=15)
@@ -165,10 +299,7 @@ def plot_gas_data_compare(x, y, y_hat, title='', fig_name=''):
 	plt.grid()
 
 	ax2 = fig.add_subplot(122)  # 2-D
-	for i in range(cat_cnt):
-		mask = (y_hat == i)
-		ax2.scatter(x[mask, 0], x[mask, 1], alpha=0.8, color=colors[i],
-					s=scatter_size)  # 2-D
+	scatter_classes(ax2, x, y_hat, colors, None, max_points, rasterized)
 	ax2.set_xlabel('Channel 0', fontsize=15)
 	ax2.set_ylabel('Channel 1', fontsize=15)
 	ax2.tick_params(labelsize=15)
@@ -178,27 +309,50 @@ def plot_gas_data_compare(x, y, y_hat, title='', fig_name=''):
 						bbox_to_anchor=(0.5, 1.1))
 	plt.grid()
 	plt.tight_layout()
-
-	if fig_name != '':
-		plt.savefig(fig_name, dpi=300, bbox_inches='tight')
-	plt.show()
+	finish_figure(fig, fig_name, dpi, show)
 
 
 def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--report', type=str, default=None,
+						help='render the figures of all ten batches into this '
+							 'folder instead of showing batch 1 and 10')
+	parser.add_argument('--processes', type=int, default=None,
+						help='number of processes rendering the report')
+	parser.add_argument('--cache', type=str, default=None,
+						help='folder to keep the parsed batches in, so later '
+							 'runs memory map them instead of parsing')
+	args = parser.parse_args()
+
+	if args.report is not None:
+		# every batch normalized the same as batch1
+		data = read_gas_batches(batch_files(), args.cache)
+		_, scaler = normalize_data(data[0][0])
+		figures = []
+		for b, (x, y) in enumerate(data, 1):
+			x = scaler.transform(x)
+			figures += [
+				('batch{}'.format(b), plot_gas_data, (x, y),
+				 {'title': 'Batch {}'.format(b)}),
+				('batch{}_pca'.format(b), pca_plot_gas_data, (x, y),
+				 {'title': 'Batch {}'.format(b)})]
+		render_report(figures, args.report, processes=args.processes)
+		return
+
 	##########################################
 	# Read and Plot
 	##########################################
 	plot_3d = False
 
-	# read batch 1
-	x1, y1 = read_gas_data('batch1.dat')
+	# read batch 1 and batch 10
+	(x1, y1), (x10, y10) = read_gas_batches(batch_files(batches=[1, 10]),
+											args.cache)
 	print(x1.shape, y1.shape)
 
 	# normalize data
 	x1, scaler = normalize_data(x1)
 
-	# read batch10 and normalize the same as batch1
-	x10, y10 = read_gas_data('batch10.dat')
+	# normalize batch10 the same as batch1
 	x10 = scaler.transform(x10)
 
 	##########################################
@@ -74,6 +74,21 @@ def save_data(data_dict, file_name):
         json.dump(data_dict, fp,  indent=4)
 
 
+def save_binary(data_dict, folder):
+    # Save the data dictionary as <user>.x.npy and <user>.y.npy per user, with an
+    # index.json of 'users' and 'num_samples', so a single user can be loaded
+    # without parsing the whole json (see hpwren/client_data.py)
+    os.makedirs(folder, exist_ok=True)
+    for user in data_dict['users']:
+        user_data = data_dict['user_data'][user]
+        np.save(os.path.join(folder, '{}.x.npy'.format(user)),
+                np.array(user_data['x'], dtype=float).reshape((len(user_data['x']), -1)))
+        np.save(os.path.join(folder, '{}.y.npy'.format(user)), np.array(user_data['y']))
+    with open(os.path.join(folder, 'index.json'), 'w') as fp:
+        json.dump({'users': data_dict['users'], 'num_samples': data_dict['num_samples']},
+                  fp, indent=4)
+
+
 # In[64]:
 
 
@@ -150,6 +165,11 @@ def main():
     save_data(test_data_dict, 'test.json')
     print('Data saved to json')
 
+    # Save data as per-user arrays
+    save_binary(train_data_dict, 'train')
+    save_binary(test_data_dict, 'test')
+    print('Data saved to train/ and test/')
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Classical forecasting baselines for every station and reading at once, on
+# the split of test_lstm.py: each table is normalized on its own, the last 4%
+# of the samples are the test windows, and a forecast is the next sample after
+# win_size-1 samples. The autoregressive models of all stations and readings
+# are fitted together by batched least squares, the ARIMA fits (statsmodels)
+# run in a process pool.
+
+import argparse
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from read_data import FEATURES
+from table_io import list_tables
+from train import load_series, split_points
+
+
+def load_station(file_name, win_size=24, test_frac=0.04):
+    """
+    Normalized series of a table and the start of its test part, as in
+    test_lstm.py
+
+    Returns:
+        data: array of (T, 12)
+        num_train: number of samples before the test part, the test windows
+            are the windows of data[num_train:]
+    """
+    data = load_series(file_name, np.float64)
+    return data, split_points(data.shape[0], 0, test_frac)[1]
+
+
+def lagged(series, lags):
+    """
+    Lags of a series
+
+    Returns:
+        x: array of (T-lags, lags, ...), the lags samples before each target,
+            oldest first
+        y: array of (T-lags, ...), the targets
+    """
+    x = sliding_window_view(series[:-1], lags, axis=0)  # (T-lags, ..., lags)
+    return np.moveaxis(x, -1, 1), series[lags:]
+
+
+def solve_batched(xtx, xty, ridge=1e-9):
+    """Solve a batch of normal equations (b, k, k) @ w = (b, k, m), with a
+    small ridge for the constant or collinear lags"""
+    k = xtx.shape[-1]
+    scale = np.trace(xtx, axis1=-2, axis2=-1)[:, None, None] / k
+    return np.linalg.solve(xtx + ridge * scale * np.eye(k), xty)
+
+
+def with_bias(x):
+    return np.concatenate([x, np.ones(x.shape[:-1] + (1,))], axis=-1)
+
+
+def test_targets(data, num_train, win_size):
+    """Indices in data of the targets of the test windows"""
+    return np.arange(num_train + win_size - 1, data.shape[0] - 1)
+
+
+def fit_ar(stations, lags):
+    """
+    Fit an AR(lags) model with intercept to every reading of every station,
+    all solved in one batch
+
+    Args:
+        stations: list of (data, num_train)
+    Returns:
+        coef: array of (num_stations, 12, lags+1)
+    """
+    xtx, xty = [], []
+    for data, num_train in stations:
+        x, y = lagged(data[:num_train], lags)  # (n, lags, 12), (n, 12)
+        x = with_bias(np.moveaxis(x, 2, 0))  # (12, n, lags+1)
+        xtx.append(np.einsum('cni,cnj->cij', x, x))
+        xty.append(np.einsum('cni,nc->ci', x, y)[..., None])
+    coef = solve_batched(np.concatenate(xtx), np.concatenate(xty))
+    return coef[..., 0].reshape(len(stations), -1, lags + 1)
+
+
+def predict_ar(data, targets, coef):
+    """One-step forecasts of the targets of a station with its AR coef"""
+    lags = coef.shape[-1] - 1
+    x = data[targets[:, None] - np.arange(lags, 0, -1)]  # (n, lags, 12)
+    return np.einsum('nlc,cl->nc', x, coef[:, :-1]) + coef[:, -1]
+
+
+def fit_linear(stations, lags):
+    """
+    Fit a linear model of the last lags samples of all readings to the next
+    sample, for every station, all solved in one batch
+
+    Returns:
+        coef: array of (num_stations, lags*12+1, 12)
+    """
+    xtx, xty = [], []
+    for data, num_train in stations:
+        x, y = lagged(data[:num_train], lags)
+        x = with_bias(x.reshape(x.shape[0], -1))
+        xtx.append(x.T @ x)
+        xty.append(x.T @ y)
+    return solve_batched(np.stack(xtx), np.stack(xty))
+
+
+def predict_linear(data, targets, coef):
+    lags = (coef.shape[0] - 1) // data.shape[1]
+    x = data[targets[:, None] - np.arange(lags, 0, -1)]
+    return with_bias(x.reshape(x.shape[0], -1)) @ coef
+
+
+def predict_naive(data, targets, season=1):
+    """Forecast a target by the sample season samples before it, 1 is the
+    last value and 24 the same hour of the previous day for hourly data"""
+    return data[targets - season]
+
+
+def fit_arima(series, num_train, targets, order):
+    """
+    Fit an ARIMA to the train part of a series and forecast each target one
+    step ahead, with the fitted parameters and the observations before it
+
+    Returns:
+        pred: array of the forecasts, None if the fit failed
+    """
+    from statsmodels.tsa.arima.model import ARIMA
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # convergence warnings
+        try:
+            fit = ARIMA(series[:num_train], order=order).fit()
+            pred = fit.apply(series).predict()
+        except (ValueError, np.linalg.LinAlgError):
+            return None
+    return pred[targets]
+
+
+def run_arima(stations, order, processes=1):
+    """
+    ARIMA forecasts of every reading of every station, one fit per process
+
+    Returns:
+        preds: list of arrays of (num_targets, 12) per station, nan where a
+            fit failed
+    """
+    tasks = [(data[:, c], num_train, targets, order)
+             for data, num_train, targets in stations
+             for c in range(data.shape[1])]
+    with ProcessPoolExecutor(processes) as pool:
+        fits = list(pool.map(fit_arima, *zip(*tasks)))
+    preds = []
+    for data, _, targets in stations:
+        pred = np.full((len(targets), data.shape[1]), np.nan)
+        for c in range(data.shape[1]):
+            fit = fits.pop(0)
+            if fit is not None:
+                pred[:, c] = fit
+        preds.append(pred)
+    return preds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', type=str, default='./2021',
+                        help='folder of the location tables')
+    parser.add_argument('--ws', type=int, default=24,
+                        help='window size of test_lstm.py, forecasts use the '
+                             'ws-1 samples before')
+    parser.add_argument('--lags', type=int, default=None,
+                        help='lags of the autoregressive models, ws-1 if not '
+                             'given')
+    parser.add_argument('--season', type=int, default=24,
+                        help='samples per season of the seasonal naive model')
+    parser.add_argument('--arima', type=int, nargs=3, default=None,
+                        metavar=('P', 'D', 'Q'),
+                        help='also fit ARIMA(P, D, Q), needs statsmodels')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes fitting the ARIMA models')
+    parser.add_argument('--report', type=str, default='baselines.json',
+                        help='json file of the MSE of every model and station')
+    args = parser.parse_args()
+    lags = args.lags or args.ws - 1
+    if lags > args.ws - 1:
+        parser.error('--lags cannot exceed the ws-1 samples of a window')
+
+    names, stations = [], []
+    for file_name in list_tables(args.folder):
+        data, num_train = load_station(file_name, args.ws)
+        targets = test_targets(data, num_train, args.ws)
+        # enough samples to fit and to test
+        if num_train <= lags + 1 or not len(targets):
+            continue
+        names.append(os.path.splitext(os.path.basename(file_name))[0])
+        stations.append((data, num_train, targets))
+    print('{} stations, {} readings each'.format(len(names), len(FEATURES)))
+
+    preds = {'naive': [predict_naive(d, t) for d, _, t in stations],
+             'seasonal': [predict_naive(d, t, args.season)
+                          for d, _, t in stations]}
+    coef = fit_ar([(d, n) for d, n, _ in stations], lags)
+    preds['ar'] = [predict_ar(d, t, c) for (d, _, t), c in zip(stations, coef)]
+    coef = fit_linear([(d, n) for d, n, _ in stations], lags)
+    preds['linear'] = [predict_linear(d, t, c)
+                       for (d, _, t), c in zip(stations, coef)]
+    if args.arima is not None:
+        try:
+            import statsmodels  # noqa: F401
+            preds['arima'] = run_arima(stations, tuple(args.arima),
+                                       args.processes)
+        except ImportError:
+            print('ARIMA skipped, statsmodels is not installed')
+
+    # MSE over all readings of the test windows, as the MSELoss of test_lstm.py
+    report = {}
+    for model, model_preds in preds.items():
+        mse = {name: float(np.nanmean((pred - data[targets]) ** 2))
+               for name, pred, (data, _, targets) in
+               zip(names, model_preds, stations)}
+        feature_mse = np.nanmean(np.concatenate(
+            [(pred - data[targets]) ** 2 for pred, (data, _, targets) in
+             zip(model_preds, stations)]), axis=0)
+        report[model] = {'mean': float(np.mean(list(mse.values()))),
+                         'stations': mse,
+                         'features': dict(zip(FEATURES, feature_mse.tolist()))}
+
+    print('{:<10}{:>10}  {}'.format('model', 'mean MSE', 'MSE per station'))
+    for model, r in report.items():
+        print('{:<10}{:>10.5f}  {}'.format(model, r['mean'], ' '.join(
+            '{}={:.4f}'.format(name, r['stations'][name]) for name in names)))
+    with open(args.report, 'w') as fp:
+        json.dump({'config': vars(args), 'results': report}, fp, indent=4)
+    print('Report saved to {}'.format(args.report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Batches of windows for training, gathered by background threads into
+# reusable (pinned, if training on a GPU) buffers, so that gathering and
+# copying the next batches overlaps with the compute of the current one.
+
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+class BatchLoader:
+    """
+    Iterate over the batches of a tensor of windows, e.g., the tensor view of
+    windows.WindowedSeries
+
+    Shuffling permutes blocks of block_size consecutive windows instead of
+    single windows, so a batch gathers a few runs of overlapping windows
+    rather than windows scattered over the whole series.
+
+    Args:
+        windows: tensor of (num_windows, win_size, num_features)
+        batch_size: number of windows per batch
+        shuffle: if True, the order of the blocks is drawn for every epoch
+        block_size: number of consecutive windows kept together by shuffling,
+            1 shuffles single windows
+        device: device the batches are moved to
+        num_workers: number of threads gathering batches
+        depth: number of buffers of each thread, i.e., batches prepared ahead
+        seed: seed of the shuffling
+    """
+
+    def __init__(self, windows, batch_size, shuffle=True, block_size=8,
+                 device=torch.device('cpu'), num_workers=2, depth=2, seed=None):
+        self.windows = windows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.device = torch.device(device)
+        self.num_workers = max(num_workers, 1)
+        self.depth = max(depth, 2)
+        self.rng = np.random.default_rng(seed)
+        self.pin_memory = self.device.type == 'cuda'
+
+        # buffers are allocated once and reused by every epoch, as normal
+        # tensors even under inference mode, which the threads do not share
+        shape = (batch_size,) + tuple(windows.shape[1:])
+        with torch.inference_mode(False):
+            self.buffers = [[torch.empty(shape, dtype=windows.dtype,
+                                         pin_memory=self.pin_memory)
+                             for _ in range(self.depth)]
+                            for _ in range(self.num_workers)]
+        self.wait = 0.0  # seconds the last epoch waited for batches
+
+    def __len__(self):
+        return (len(self.windows) + self.batch_size - 1) // self.batch_size
+
+    def order(self):
+        """Order of the windows for one epoch"""
+        n = len(self.windows)
+        if not self.shuffle:
+            return torch.arange(n)
+        num_blocks = (n + self.block_size - 1) // self.block_size
+        blocks = self.rng.permutation(num_blocks)
+        index = (blocks[:, None] * self.block_size +
+                 np.arange(self.block_size)).reshape(-1)
+        return torch.from_numpy(index[index < n])
+
+    def _work(self, w, index, free, ready, stop):
+        # gather the batches w, w+num_workers, ... into the buffers of worker w,
+        # an error is passed on to the consumer
+        try:
+            for b in range(w, len(self), self.num_workers):
+                buffer = free.get()
+                if stop.is_set():
+                    return
+                inds = index[b * self.batch_size:(b + 1) * self.batch_size]
+                with torch.no_grad():
+                    torch.index_select(self.windows, 0, inds,
+                                       out=buffer[:len(inds)])
+                ready.put((buffer, len(inds)))
+        except Exception as e:
+            ready.put((e, 0))
+
+    def __iter__(self):
+        """
+        Yields:
+            batch: tensor of (batch_size, win_size, num_features) on the
+                device, only valid until the next batch is drawn
+        """
+        index = self.order()
+        stop = threading.Event()
+        frees, readies, threads = [], [], []
+        for w in range(self.num_workers):
+            free, ready = queue.Queue(), queue.Queue()
+            for buffer in self.buffers[w]:
+                free.put(buffer)
+            thread = threading.Thread(target=self._work,
+                                      args=(w, index, free, ready, stop),
+                                      daemon=True)
+            thread.start()
+            frees.append(free)
+            readies.append(ready)
+            threads.append(thread)
+
+        self.wait = 0.0
+        held, done = None, None
+        try:
+            for b in range(len(self)):
+                w = b % self.num_workers
+                st = time.time()
+                buffer, n = readies[w].get()
+                self.wait += time.time() - st
+                if isinstance(buffer, Exception):
+                    raise buffer
+                batch = buffer[:n]
+                if self.device.type != 'cpu':
+                    batch = batch.to(self.device, non_blocking=self.pin_memory)
+                # the buffer of the previous batch can be filled again once
+                # its copy to the device is over
+                if held is not None:
+                    if done is not None:
+                        done.synchronize()
+                    frees[held[0]].put(held[1])
+                held = (w, buffer)
+                if self.device.type == 'cuda':
+                    done = torch.cuda.Event()
+                    done.record()
+                yield batch
+        finally:
+            stop.set()
+            for free in frees:
+                free.put(None)
+            for thread in threads:
+                thread.join()
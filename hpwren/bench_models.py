@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# CPU cost of the models of models.py across hidden sizes, window sizes, batch
+# sizes and thread counts: training throughput, inference latency, peak memory
+# and number of parameters, and optionally the test MSE on a table, to pick the
+# cheapest model that is accurate enough.
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import torch
+
+from batch_loader import BatchLoader
+from models import MODELS, build_model
+from train import load_series, make_splits
+
+NUM_FEATURES = 12
+
+
+class PeakMemory:
+    """
+    Peak resident memory above the resident memory at entry, sampled by a
+    thread every interval seconds (Linux only, 0 elsewhere)
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return 0
+
+    def _sample(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, self.rss() - self.base)
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.base = self.rss()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.rss() - self.base)
+
+
+def bench_model(name, hidden_size, win_size, batch_size, threads, warmup=5,
+                repeat=50, lr=0.001):
+    """
+    Time training steps and forecasts of a model on random windows
+
+    Returns:
+        result: dictionary of the parameter count, training samples per
+            second, p50/p99 forecast latency in ms and peak memory in MB
+    """
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    model = build_model(name, NUM_FEATURES, hidden_size, NUM_FEATURES,
+                        seq_len=win_size - 1)
+    x = torch.randn(batch_size, win_size - 1, NUM_FEATURES)
+    y = torch.randn(batch_size, NUM_FEATURES)
+    criterion = torch.nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    # a forecast of another shape would be broadcast by the loss and timed
+    # on the wrong computation
+    with torch.no_grad():
+        shape = tuple(model(x).shape)
+    if shape != tuple(y.shape):
+        raise ValueError('{} forecasts {} for a batch of {}, not {}'.format(
+            name, shape, batch_size, tuple(y.shape)))
+
+    def train_step():
+        optimizer.zero_grad()
+        loss = criterion(y, model(x))
+        loss.backward()
+        optimizer.step()
+
+    with PeakMemory() as memory:
+        model.train()
+        for _ in range(warmup):
+            train_step()
+        st = time.perf_counter()
+        for _ in range(repeat):
+            train_step()
+        train_time = time.perf_counter() - st
+
+        model.eval()
+        latency = []
+        with torch.inference_mode():
+            for _ in range(warmup):
+                model(x)
+            for _ in range(repeat):
+                st = time.perf_counter()
+                model(x)
+                latency.append(time.perf_counter() - st)
+
+    return {'params': sum(p.numel() for p in model.parameters()),
+            'train_samples_per_s': repeat * batch_size / train_time,
+            'p50_ms': 1000 * float(np.percentile(latency, 50)),
+            'p99_ms': 1000 * float(np.percentile(latency, 99)),
+            'peak_mb': memory.peak / 1024**2}
+
+
+def eval_accuracy(name, hidden_size, win_size, table, epochs, batch_size=32,
+                  test_frac=0.04, lr=0.001):
+    """Train a model on a table as test_lstm.py does and return its test MSE"""
+    torch.manual_seed(0)
+    train, _, test = make_splits(load_series(table), win_size, 0, test_frac)
+
+    model = build_model(name, NUM_FEATURES, hidden_size, NUM_FEATURES,
+                        seq_len=win_size - 1)
+    criterion = torch.nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    for _ in range(epochs):
+        model.train()
+        for batch in BatchLoader(train, batch_size, seed=0):
+            optimizer.zero_grad()
+            loss = criterion(batch[:, -1], model(batch[:, :-1]))
+            loss.backward()
+            optimizer.step()
+    model.eval()
+    with torch.inference_mode():
+        return criterion(test[:, -1], model(test[:, :-1])).item()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=str, nargs='+', default=MODELS,
+                        choices=MODELS, help='models to benchmark')
+    parser.add_argument('--hidden-sizes', type=int, nargs='+',
+                        default=[32, 128], help='hidden sizes')
+    parser.add_argument('--ws', type=int, nargs='+', default=[24],
+                        help='window sizes, the models see ws-1 steps')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32],
+                        help='batch sizes')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1],
+                        help='numbers of intra-op threads')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='number of untimed steps before timing')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='number of timed steps')
+    parser.add_argument('--isolate', action='store_true',
+                        help='run each setting in a new process, so the peak '
+                             'memory is not hidden by memory freed earlier')
+    parser.add_argument('--table', type=str, default=None,
+                        help='table to measure the test MSE on, e.g., 2021/MG')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='number of epochs trained for the test MSE')
+    parser.add_argument('--report', default='bench_models.json',
+                        help='json file to write the results to')
+    args = parser.parse_args()
+
+    report = {'config': vars(args),
+              'environment': {'python': platform.python_version(),
+                              'torch': torch.__version__,
+                              'platform': platform.platform(),
+                              'cpu_count': os.cpu_count()},
+              'time': datetime.datetime.now().isoformat(),
+              'results': []}
+
+    # the accuracy does not depend on the batch size and threads of timing
+    mse = {}
+    if args.table is not None:
+        for name, hidden_size, win_size in itertools.product(
+                args.models, args.hidden_sizes, args.ws):
+            mse[(name, hidden_size, win_size)] = eval_accuracy(
+                name, hidden_size, win_size, args.table, args.epochs)
+
+    print('{:<6}{:>8}{:>5}{:>7}{:>9}{:>10}{:>14}{:>9}{:>9}{:>9}{:>10}'.format(
+        'model', 'hidden', 'ws', 'batch', 'threads', 'params', 'train samp/s',
+        'p50 ms', 'p99 ms', 'peak MB', 'test MSE'))
+    for name, hidden_size, win_size, batch_size, threads in itertools.product(
+            args.models, args.hidden_sizes, args.ws, args.batch_sizes,
+            args.threads):
+        result = {'model': name, 'hidden_size': hidden_size,
+                  'win_size': win_size, 'batch_size': batch_size,
+                  'threads': threads}
+        bench_args = (name, hidden_size, win_size, batch_size, threads,
+                      args.warmup, args.repeat)
+        if args.isolate:
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+                result.update(pool.submit(bench_model, *bench_args).result())
+        else:
+            result.update(bench_model(*bench_args))
+        result['test_mse'] = mse.get((name, hidden_size, win_size))
+        report['results'].append(result)
+        print('{:<6}{:>8}{:>5}{:>7}{:>9}{:>10}{:>14.0f}{:>9.3f}{:>9.3f}'
+              '{:>9.1f}{:>10}'.format(
+                  name, hidden_size, win_size, batch_size, threads,
+                  result['params'], result['train_samples_per_s'],
+                  result['p50_ms'], result['p99_ms'], result['peak_mb'],
+                  '-' if result['test_mse'] is None
+                  else '{:.5f}'.format(result['test_mse'])))
+
+    with open(args.report, 'w') as fp:
+        json.dump(report, fp, indent=4)
+    print('Report saved to {}'.format(args.report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmarks of the HPWREN query pipeline on synthetic data, so that the
+# throughput can be measured without hitting the live site.
+
+import argparse
+import datetime
+import functools
+import io
+import json
+import os
+import platform
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from crawler import Crawler, decode
+from parse_errors import ParseErrors
+from query_data import all_header, average_day, fill_day, filePattern, \
+    header, new_location_data, parse_page, write_data_csv
+from table_io import table_format
+
+# readings reported by a station, with the unit suffix of their values
+READINGS = [('Dn', 'D'), ('Dm', 'D'), ('Dx', 'D'), ('Sn', 'M'), ('Sm', 'M'),
+            ('Sx', 'M'), ('Ta', 'C'), ('Ua', 'P'), ('Pa', 'H'), ('Rc', 'M'),
+            ('Rd', 's'), ('Ri', 'M'), ('Hc', 'M'), ('Hd', 's'), ('Hi', 'M'),
+            ('Vs', 'V')]
+# readings that some stations never report
+OPTIONAL = ['Rc', 'Rd', 'Ri', 'Hc', 'Hd', 'Hi']
+
+
+def make_day_file(sample_period=1, start_time=1609459200, missing_rate=0.0,
+                  optional=True, seed=0):
+    """
+    Generate the text of a synthetic raw day file in the HPWREN format, i.e.,
+    one tab separated line per sample ending with 0R0,Dn=286D,Dm=288D,...
+
+    Args:
+        sample_period: seconds between two samples
+        start_time: unix time of the first sample
+        missing_rate: probability of dropping each reading of a sample
+        optional: if False, the station never reports the OPTIONAL readings
+        seed: seed of the random generator
+    Returns:
+        page: the text of the day file
+    """
+    rng = np.random.default_rng(seed)
+    readings = [(r, u) for r, u in READINGS if optional or r not in OPTIONAL]
+    times = np.arange(start_time, start_time + 24*3600, sample_period)
+    values = rng.uniform(0, 1000, size=(len(times), len(readings)))
+    keep = rng.random(values.shape) >= missing_rate
+
+    lines = []
+    for i, t in enumerate(times):
+        records = ['{}={:.1f}{}'.format(r, values[i, j], u)
+                   for j, (r, u) in enumerate(readings) if keep[i, j]]
+        lines.append('hpwren\t{}\t{}\t0R0,{}'.format(
+            time.strftime('%Y-%m-%d', time.gmtime(t)), t, ','.join(records)))
+    return '\n'.join(lines) + '\n'
+
+
+def make_site(root, y='2021', stations=4, days=7, sample_period=60,
+                missing_rate=0.0, optional_rate=0.5, seed=0):
+    """
+    Generate a synthetic HPWREN directory tree root/y/YYYYMMDD/<raw files>
+
+    Args:
+        root: directory of the site
+        y: the year of the data, str
+        stations: number of stations
+        days: number of days from the first day of the year
+        sample_period: seconds between two samples
+        missing_rate: probability of dropping each reading of a sample
+        optional_rate: fraction of stations reporting the OPTIONAL readings
+        seed: seed of the random generator
+    Returns:
+        num_bytes: total size of the raw files
+    """
+    num_bytes = 0
+    dt_1st_day = datetime.datetime.strptime(y + '0101', '%Y%m%d')
+    for n in range(days):
+        day = dt_1st_day + datetime.timedelta(n)
+        day_path = os.path.join(root, y, day.strftime('%Y%m%d'))
+        os.makedirs(day_path, exist_ok=True)
+        for i in range(stations):
+            page = make_day_file(
+                sample_period,
+                start_time=int(day.replace(tzinfo=datetime.timezone.utc).timestamp()),
+                missing_rate=missing_rate,
+                optional=i < optional_rate * stations,
+                seed=seed + n * stations + i)
+            file_name = 'hpwren:S{:03d}-W{}'.format(i, filePattern)
+            with open(os.path.join(day_path, file_name), 'w') as f:
+                f.write(page)
+            num_bytes += len(page)
+    return num_bytes
+
+
+class ListingHandler(SimpleHTTPRequestHandler):
+    """Serve files with directory listings of ./name links, as the HPWREN site"""
+
+    def list_directory(self, path):
+        names = sorted(os.listdir(path))
+        links = ['<a href="./{0}{1}">{0}{1}</a>'.format(
+            name, '/' if os.path.isdir(os.path.join(path, name)) else '')
+            for name in names]
+        body = '<html><body>\n{}\n</body></html>\n'.format(
+            '\n'.join(links)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(root):
+    """Serve root on a local port, yielding the base url"""
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(ListingHandler, directory=root))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_pipeline(base_url, y, out_dir, workers=8, interval=60, fmt='csv'):
+    """
+    Time each stage of the query pipeline on a site
+
+    Returns:
+        stages: dictionary of {stage: {'seconds', 'items', 'items_per_s'}}
+            for the stages listing, download, parse, resample and write
+    """
+    crawler = Crawler(workers=workers, rate=0)
+    day_sample_num = int(24*60/interval)
+    stages = {}
+
+    def record(stage, st, items, **extra):
+        seconds = time.perf_counter() - st
+        stages[stage] = dict(seconds=seconds, items=items,
+                             items_per_s=items / max(seconds, 1e-9), **extra)
+
+    st = time.perf_counter()
+    targets = crawler.list_targets(base_url, y, filePattern)
+    record('listing', st, len(targets))
+
+    st = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        pages = list(pool.map(
+            lambda item: decode(crawler.get(item[1]).content), targets))
+    num_bytes = sum(len(page) for page in pages)
+    record('download', st, len(pages), mb_per_s=num_bytes / 1024**2 /
+           max(time.perf_counter() - st, 1e-9))
+
+    st = time.perf_counter()
+    errors = ParseErrors()
+    parsed = [parse_page(page, header, errors, loc, d)
+              for page, ((loc, d), _) in zip(pages, targets)]
+    record('parse', st, sum(len(p) for p in parsed),
+           anomalies=dict(errors.totals()))
+
+    st = time.perf_counter()
+    averaged = [average_day(header, p, interval, day_sample_num)
+                for p in parsed]
+    record('resample', st, len(averaged))
+
+    st = time.perf_counter()
+    dt_1st_day = datetime.datetime.strptime(y + '0101', '%Y%m%d')
+    data = {}
+    for ((loc, d), _), day_data in zip(targets, averaged):
+        if loc not in data:
+            data[loc] = new_location_data(y, interval)
+        delta_days = (datetime.datetime.strptime(d, '%Y%m%d') - dt_1st_day).days
+        fill_day(data[loc], delta_days, header, day_data, day_sample_num)
+    for loc in sorted(data):
+        write_data_csv(os.path.join(out_dir, '{}.{}'.format(loc, fmt)),
+                       all_header, data[loc])
+    record('write', st, len(data))
+    return stages
+
+
+def compare_reports(report, baseline, tolerance):
+    """
+    Find the stages of report slower than in baseline by more than tolerance
+
+    Returns:
+        regressions: list of (stage, baseline items/s, items/s)
+    """
+    regressions = []
+    for stage, result in report['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        before = baseline['stages'][stage]['items_per_s']
+        if result['items_per_s'] < before * (1 - tolerance):
+            regressions.append((stage, before, result['items_per_s']))
+    return regressions
+
+
+def legacy_parse_page(page, header):
+    """The per-record parser of query_data.py before vectorization"""
+    def align_data(header, reading, value):
+        fileData = []
+        for i in range(len(header)):
+            try:
+                idx = reading.index(header[i])
+                fileData.append(value[idx])
+            except Exception as e:
+                print('Error: {}'.format(e))
+                print('Current header {} not in the list of {}'.format(header[i], reading))
+                fileData.append(float("nan"))
+        return fileData
+
+    fileData = []
+    samples = page.strip().split('\n')
+    fileTime = [int(sample.split('\t')[2]) for sample in samples]
+    startTime = fileTime[0]
+    fileTime = [t - startTime for t in fileTime]
+    dataString = [sample.split('\t')[3] for sample in samples]
+    for idx in range(len(dataString)):
+        dataPhrase = dataString[idx].strip('0R0,').split(',')
+        reading, value = [], []
+        for ele in dataPhrase:
+            record = ele.split('=')
+            reading.append(record[0])
+            value.append(float(re.findall(r'[\d.-]*', record[1])[0]))
+        reading.insert(0, 't')
+        value.insert(0, fileTime[idx])
+        fileData.append(align_data(header, reading, value))
+    return fileData
+
+
+def best_time(func, repeat):
+    """Best wall time in seconds of func over repeat runs, and its result"""
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - st)
+    return min(times), result
+
+
+def bench_parse(page, repeat=3):
+    """
+    Time the legacy and vectorized parsers on the same day file
+
+    Returns:
+        legacy_time, new_time: best wall time of each parser, in seconds
+    """
+    # the legacy parser prints on every missing reading, keep it off the console
+    with redirect_stdout(io.StringIO()):
+        legacy_time, legacy = best_time(
+            lambda: legacy_parse_page(page, header), repeat)
+    new_time, new = best_time(lambda: parse_page(page, header), repeat)
+    assert np.array_equal(np.array(legacy), new, equal_nan=True), \
+        'The vectorized parser differs from the legacy parser'
+    return legacy_time, new_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', type=int, default=4,
+                        help='number of synthetic stations')
+    parser.add_argument('--days', type=int, default=7,
+                        help='number of synthetic days')
+    parser.add_argument('--sample-period', type=int, default=60,
+                        help='seconds between two synthetic samples')
+    parser.add_argument('--missing-rate', type=float, default=0.05,
+                        help='probability of dropping each reading')
+    parser.add_argument('--optional-rate', type=float, default=0.5,
+                        help='fraction of stations reporting Rc/Rd/Ri/Hc/Hd/Hi')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent downloads')
+    parser.add_argument('--format', default='csv', type=table_format,
+                        choices=['csv', 'npy', 'parquet'],
+                        help='format of the per-location files')
+    parser.add_argument('--legacy-parse', action='store_true',
+                        help='also time the former parser on one day file')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of the parser comparison')
+    parser.add_argument('--report', default='benchmark.json',
+                        help='json file to write the results to')
+    parser.add_argument('--baseline', default=None,
+                        help='json report to compare the throughput with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed throughput drop against the baseline')
+    args = parser.parse_args()
+
+    report = {'config': vars(args),
+              'environment': {'python': platform.python_version(),
+                              'numpy': np.__version__,
+                              'platform': platform.platform(),
+                              'cpu_count': os.cpu_count()},
+              'time': datetime.datetime.now().isoformat()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site = os.path.join(tmp, 'site')
+        y = '2021'
+        st = time.perf_counter()
+        num_bytes = make_site(site, y, args.stations, args.days,
+                              args.sample_period, args.missing_rate,
+                              args.optional_rate)
+        print('generated {} days of {} stations ({:.1f} MB) in {:.1f}s'.format(
+            args.days, args.stations, num_bytes / 1024**2,
+            time.perf_counter() - st))
+
+        out_dir = os.path.join(tmp, 'out')
+        os.makedirs(out_dir)
+        with serve(site) as base_url, redirect_stdout(io.StringIO()):
+            report['stages'] = bench_pipeline(base_url, y, out_dir,
+                                              args.workers, fmt=args.format)
+
+    if args.legacy_parse:
+        page = make_day_file(args.sample_period, missing_rate=args.missing_rate,
+                             optional=False)
+        legacy_time, new_time = bench_parse(page, args.repeat)
+        report['parse_comparison'] = {'legacy_s': legacy_time, 'new_s': new_time,
+                                      'speedup': legacy_time / new_time}
+
+    for stage, result in report['stages'].items():
+        print('{:<10} {:>8.3f}s {:>9d} items {:>12.1f} items/s'.format(
+            stage, result['seconds'], result['items'], result['items_per_s']))
+    if args.legacy_parse:
+        print('parse: legacy {legacy_s:.3f}s vectorized {new_s:.3f}s '
+              'speedup {speedup:.1f}x'.format(**report['parse_comparison']))
+
+    with open(args.report, 'w') as fp:
+        json.dump(report, fp, indent=4)
+    print('report written to {}'.format(args.report))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for stage, before, after in regressions:
+            print('REGRESSION {}: {:.1f} -> {:.1f} items/s'.format(
+                stage, before, after))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
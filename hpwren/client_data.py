@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Per-user access to a federated split written by read_data.py (or by
+# har/read_data.py), for simulations that only train a few users per round.
+# Users are read lazily from the split, kept in a memory-bounded LRU cache and
+# the users of the next round are loaded by a background thread.
+
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import fed_data
+
+
+class ClientData:
+    """
+    Data of the users of a split, loaded on demand
+
+    Args:
+        folder: folder of the split, e.g., train
+        max_bytes: the least recently used users are evicted above this size,
+            counting the users being prefetched, the user being returned is
+            always kept
+        prefetch_workers: number of threads loading users ahead, 0 disables
+            prefetching
+    """
+
+    def __init__(self, folder, max_bytes=512*1024**2, prefetch_workers=1):
+        self.folder = folder
+        self.index = fed_data.load_index(folder)
+        self.users = self.index['users']
+        self.num_samples = dict(zip(self.users, self.index['num_samples']))
+        self.max_bytes = max_bytes
+
+        self.cache = OrderedDict()  # user -> (x, y, nbytes), oldest first
+        self.size = 0
+        self.pending = {}  # user -> future of a prefetch
+        self.reserved = 0  # bytes of the users being prefetched
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(prefetch_workers) \
+            if prefetch_workers > 0 else None
+        self.hits, self.misses = 0, 0
+        self.wait = 0.0  # seconds get spent loading or waiting for users
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+    def _nbytes(self, user):
+        return sum(os.path.getsize(f) for f in
+                   fed_data.user_files(self.folder, user, self.index))
+
+    def _load(self, user):
+        # read the arrays of a user into memory, the windows of a hpwren user
+        # stay views of its series
+        x, y = fed_data.load_user(self.folder, user, self.index, mmap=False)
+        return x, y, self._nbytes(user)
+
+    def _evict(self, keep=1):
+        # called with the lock held, keep the keep most recent users
+        while self.size + self.reserved > self.max_bytes and \
+                len(self.cache) > keep:
+            _, (_, _, nbytes) = self.cache.popitem(last=False)
+            self.size -= nbytes
+
+    def _insert(self, user, entry):
+        with self.lock:
+            if user in self.cache:
+                return
+            self.cache[user] = entry
+            self.size += entry[2]
+            self._evict()
+
+    def _prefetch(self, user, nbytes):
+        # load a user into the cache and release the bytes reserved for it
+        try:
+            entry = self._load(user)
+        finally:
+            with self.lock:
+                self.reserved -= nbytes
+                self.pending.pop(user, None)
+        self._insert(user, entry)
+        return entry
+
+    def get(self, user):
+        """
+        Get the data of a user
+
+        Returns:
+            x, y: arrays of the user, shared with the cache so not to be
+                modified
+        """
+        if user not in self.num_samples:
+            raise KeyError('Unknown user {}'.format(user))
+        with self.lock:
+            if user in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(user)
+                x, y, _ = self.cache[user]
+                return x, y
+            self.misses += 1
+            future = self.pending.get(user)
+        st = time.time()
+        entry = future.result() if future is not None else self._load(user)
+        self.wait += time.time() - st
+        self._insert(user, entry)
+        return entry[0], entry[1]
+
+    def batches(self, user, batch_size, shuffle=True, rng=None):
+        """
+        Iterate over mini-batches of a user
+
+        Args:
+            user: the user name
+            batch_size: number of samples per batch
+            shuffle: if True, the samples are drawn in a random order
+            rng: numpy random Generator, a new one if None
+        Yields:
+            x, y: copies of the samples of the batch
+        """
+        x, y = self.get(user)
+        n = len(x)
+        if shuffle:
+            rng = rng if rng is not None else np.random.default_rng()
+            index = rng.permutation(n)
+        else:
+            index = np.arange(n)
+        for st in range(0, n, batch_size):
+            inds = index[st:st + batch_size]
+            yield x[inds], y[inds]
+
+    def prefetch(self, users):
+        """
+        Start loading users in the background, if not cached already
+
+        The bytes of the users are reserved in the cache before they are
+        loaded, evicting the least recently used users, and the users that do
+        not fit in max_bytes with the ones already being prefetched are left
+        to be loaded when used.
+        """
+        if self.pool is None:
+            return
+        with self.lock:
+            for user in users:
+                if user in self.cache or user in self.pending:
+                    continue
+                nbytes = self._nbytes(user)
+                if self.reserved + nbytes > self.max_bytes:
+                    break
+                self.reserved += nbytes
+                self._evict(keep=0)
+                self.pending[user] = self.pool.submit(self._prefetch, user,
+                                                      nbytes)
+
+    def rounds(self, num_rounds, users_per_round, seed=0):
+        """
+        Sample the users of each round, prefetching the users of the next
+        round while the current one is used
+
+        Args:
+            num_rounds: number of rounds
+            users_per_round: number of users sampled without replacement
+            seed: seed of the sampling
+        Yields:
+            users: the users of a round
+        """
+        rng = np.random.default_rng(seed)
+        k = min(users_per_round, len(self.users))
+        sample = [self.users[i] for i in rng.choice(len(self.users), k,
+                                                     replace=False)]
+        self.prefetch(sample)
+        for r in range(num_rounds):
+            current = sample
+            if r + 1 < num_rounds:
+                sample = [self.users[i] for i in
+                          rng.choice(len(self.users), k, replace=False)]
+                self.prefetch(sample)
+            yield current
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='simulate federated rounds over a split and report the '
+                    'time spent loading users')
+    parser.add_argument('folder', help='folder of the split, e.g., train')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='number of rounds')
+    parser.add_argument('--users-per-round', type=int, default=10,
+                        help='number of users sampled per round')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='batch size of the local epochs')
+    parser.add_argument('--cache-size', type=int, default=512,
+                        help='size of the user cache in MB')
+    parser.add_argument('--no-prefetch', action='store_true',
+                        help='load the users of a round only when used')
+    args = parser.parse_args()
+
+    with ClientData(args.folder, args.cache_size * 1024**2,
+                    0 if args.no_prefetch else 1) as clients:
+        st = time.time()
+        for r, users in enumerate(clients.rounds(args.rounds,
+                                                 args.users_per_round)):
+            samples = 0
+            for user in users:
+                for x, y in clients.batches(user, args.batch_size):
+                    samples += len(x)
+            print('round {}: {} users, {} samples'.format(r, len(users),
+                                                        samples))
+        total = time.time() - st
+        print('{} hits, {} misses, {:.1f} MB cached, {:.2f}s of {:.2f}s '
+              'waiting for users'.format(clients.hits, clients.misses,
+                                         clients.size / 1024**2, clients.wait,
+                                         total))
+
+
+if __name__ == "__main__":
+    main()
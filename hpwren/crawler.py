@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Concurrent crawler for the HPWREN raw sensor data.
+# All requests share one pooled HTTP session, are rate limited per host and
+# retried with exponential backoff. The output keeps the year/loc/day.csv layout
+# of query_data.py.
+
+import datetime
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import CacheMiss
+from query_data import average_day, fill_day, new_location_data, \
+    parse_dir_listing, parse_lines, parse_page, write_csv
+
+# status codes worth retrying, the others are raised right away
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second with bursts of `burst`"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request is allowed"""
+        if self.rate <= 0:  # no limit
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Crawler:
+    """
+    Fetch HPWREN index pages and raw files with bounded concurrency
+
+    Args:
+        workers: number of concurrent requests
+        rate: max requests per second to each host, <= 0 means no limit
+        retries: number of retries of a failed request
+        backoff: base delay in seconds, doubled after each retry
+        timeout: timeout in seconds of a single request
+        cache: HTTPCache of the responses, None means no cache
+        errors: ParseErrors accounting the parse anomalies, None to ignore them
+    """
+
+    def __init__(self, workers=8, rate=10.0, retries=3, backoff=0.5,
+                 timeout=30, cache=None, errors=None):
+        self.workers = workers
+        self.cache = cache
+        self.errors = errors
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # one connection pool shared by all the worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self.limiters_lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rate)
+            return self.limiters[host]
+
+    def request(self, method, url, stream=False):
+        """
+        Send a request, retrying connection errors and retryable status codes
+
+        Returns:
+            response: the successful requests.Response
+        """
+        limiter = self._limiter(url)
+        for attempt in range(self.retries + 1):
+            limiter.acquire()
+            try:
+                response = self.session.request(method, url,
+                                                timeout=self.timeout,
+                                                stream=stream)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(
+                    '{} for url {}'.format(response.status_code, url),
+                    response=response)
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == self.retries:
+                raise error
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def get(self, url, stream=False):
+        return self.request('GET', url, stream=stream)
+
+    def head(self, url):
+        return self.request('HEAD', url)
+
+    def fetch(self, url, mutable=False):
+        """
+        Get the body and headers of url, from the cache if possible
+
+        Args:
+            url: the url to get
+            mutable: if True, the page may still change, e.g., the raw file of
+                today, and its cached copy expires
+        Returns:
+            content, headers: the body in bytes and a dictionary of headers
+        """
+        if self.cache is not None:
+            content, headers = self.cache.get(url, mutable)
+            if content is not None:
+                return content, headers
+            if self.cache.offline:
+                raise CacheMiss(url)
+        response = self.get(url)
+        content, headers = response.content, dict(response.headers)
+        if self.cache is not None:
+            self.cache.put(url, content, headers)
+        return content, headers
+
+    def fetch_headers(self, url, mutable=False):
+        """Get the headers of url, from the cache if possible"""
+        if self.cache is not None:
+            _, headers = self.cache.get(url, mutable)
+            if headers is not None:
+                return headers
+            if self.cache.offline:
+                raise CacheMiss(url)
+        return dict(self.head(url).headers)
+
+    def list_dir(self, url, pattern, mutable=False):
+        """Get the subdirectories of url that satisfy the given pattern"""
+        content, _ = self.fetch(url, mutable)
+        return parse_dir_listing(decode(content), pattern)
+
+    def list_year(self, base_url, y, file_pattern):
+        """
+        List the raw files of a year
+
+        Returns:
+            files: list of (day, file name, file url), ordered as the listings
+        """
+        year_url = base_url + y + '/'
+        # the listing of a year in progress still gets new days
+        this_year = datetime.datetime.now(datetime.timezone.utc).year
+        days = self.list_dir(year_url, y + r'\d*', mutable=int(y) >= this_year)
+        if not len(days):
+            print('yearURL {} is empty!'.format(year_url))
+            return []
+
+        def list_day(d):
+            return self.list_dir(year_url + d + '/', file_pattern,
+                                 mutable=not day_complete(d))
+
+        files = []
+        with ThreadPoolExecutor(self.workers) as pool:
+            for d, day_files in zip(days, pool.map(list_day, days)):
+                if not len(day_files):
+                    print('dayURL {} is empty!'.format(year_url + d + '/'))
+                for f in day_files:
+                    files.append((d, f, year_url + d + '/' + f))
+        return files
+
+    def list_targets(self, base_url, y, file_pattern):
+        """
+        List the raw file to query for each location and day of a year
+
+        Returns:
+            targets: sorted list of ((location, day), file url)
+        """
+        # several files of a day may map to the same location, the last one
+        # listed wins as it did when files were queried one after another
+        targets = {}
+        for d, f, file_url in self.list_year(base_url, y, file_pattern):
+            loc = f.split(':')[1].split('-')[0]
+            targets[(loc, d)] = file_url
+        return sorted(targets.items())
+
+    def crawl_year(self, base_url, y, file_pattern, header, manifest=None):
+        """
+        Download and parse the raw files of a year into y/loc/day.csv
+
+        Args:
+            base_url: url of the HPWREN data directory
+            y: the year to query, str
+            file_pattern: pattern of the raw files to query
+            header: the readings to keep
+            manifest: Manifest of the fetched files, files recorded in it are
+                only downloaded again if they changed on the server
+        Returns:
+            written: list of the csv files written
+        """
+        targets = {}
+        for (loc, d), file_url in self.list_targets(base_url, y, file_pattern):
+            targets[os.path.join(y, loc, '{}.csv'.format(d))] = (loc, d, file_url)
+
+        def fetch(item):
+            file_path, (loc, d, file_url) = item
+            entry = manifest.get(file_path) if manifest is not None else None
+            # a record only holds if it was fetched from the same url and
+            # parsed with the same header
+            if entry is not None and (entry['url'] != file_url or
+                                      entry['header'] != header):
+                entry = None
+            if entry is not None and os.path.exists(file_path):
+                if entry['complete']:  # the day is over, the file is final
+                    return None
+                headers = self.fetch_headers(file_url, mutable=True)
+                if same_file(entry, headers):
+                    # the day may have settled since the file was recorded
+                    if entry['complete'] != day_complete(d):
+                        manifest.update(file_path,
+                                        dict(entry, complete=day_complete(d)))
+                    return None
+
+            print('querying file {}'.format(file_url))
+            content, headers = self.fetch(file_url, mutable=not day_complete(d))
+            record = {'url': file_url,
+                      'size': headers.get('Content-Length'),
+                      'last_modified': headers.get('Last-Modified'),
+                      'sha256': hashlib.sha256(content).hexdigest(),
+                      'header': header,
+                      'complete': day_complete(d)}
+            if entry is not None and entry['sha256'] == record['sha256'] \
+                    and os.path.exists(file_path):
+                manifest.update(file_path, record)
+                return None
+
+            file_data = parse_page(decode(content), header, self.errors, loc,
+                                   d)
+            write_day_csv(file_path, header, file_data)
+            if manifest is not None:
+                manifest.update(file_path, record)
+            return file_path
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            written = pool.map(fetch, sorted(targets.items()))
+            return [file_path for file_path in written if file_path is not None]
+
+    def stream_year(self, base_url, y, file_pattern, header, interval=60,
+                    raw=False):
+        """
+        Download the raw files of a year and average them straight into the
+        data of each location, without writing and reading back day csv files
+
+        Args:
+            base_url: url of the HPWREN data directory
+            y: the year to query, str
+            file_pattern: pattern of the raw files to query
+            header: the readings to keep
+            interval: number of minutes per sample after averaging
+            raw: if True, also write the raw y/loc/day.csv files
+        Returns:
+            data: dictionary of the data of each location, as new_location_data
+        """
+        dt_1st_day = datetime.datetime.strptime(y + '0101', '%Y%m%d')
+        day_sample_num = int(24*60/interval)
+        targets = self.list_targets(base_url, y, file_pattern)
+
+        def fetch(item):
+            (loc, d), file_url = item
+            print('querying file {}'.format(file_url))
+            if self.cache is not None:
+                content, _ = self.fetch(file_url, mutable=not day_complete(d))
+                file_data = parse_lines(decode(content).splitlines(), header,
+                                        self.errors, loc, d)
+            else:
+                with self.get(file_url, stream=True) as response:
+                    response.encoding = response.encoding or 'utf-8'
+                    lines = response.iter_lines(decode_unicode=True)
+                    file_data = parse_lines(lines, header, self.errors, loc,
+                                            d)
+            if raw:
+                file_path = os.path.join(y, loc, '{}.csv'.format(d))
+                write_day_csv(file_path, header, file_data)
+            return average_day(header, file_data, interval, day_sample_num,
+                               file_url)
+
+        # days are averaged by the workers and merged here in a fixed order
+        data = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            for ((loc, d), _), day_data in zip(targets, pool.map(fetch, targets)):
+                if loc not in data:
+                    data[loc] = new_location_data(y, interval)
+                delta_days = (datetime.datetime.strptime(d, '%Y%m%d') -
+                              dt_1st_day).days
+                fill_day(data[loc], delta_days, header, day_data,
+                         day_sample_num)
+        return data
+
+
+def decode(content):
+    """Decode the body of a page, the HPWREN pages are plain ascii"""
+    return content.decode('utf-8', errors='replace')
+
+
+def write_day_csv(file_path, header, file_data):
+    """
+    Write the parsed data of a day file, through a temporary file so that a
+    crash never leaves a partial csv behind
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    write_csv(file_path + '.part', header, file_data)
+    os.replace(file_path + '.part', file_path)
+
+
+def same_file(entry, headers):
+    """
+    Whether the HEAD headers of a raw file show it is still the file recorded
+    in a manifest entry. A header the server does not send is unknown, so
+    without Content-Length and Last-Modified the file has to be fetched and
+    compared by its sha256.
+    """
+    known = [(entry[key], headers[name]) for key, name in
+             [('size', 'Content-Length'), ('last_modified', 'Last-Modified')]
+             if headers.get(name) is not None]
+    return len(known) > 0 and all(old == new for old, new in known)
+
+
+def day_complete(d, settle_days=1):
+    """
+    Whether the raw file of day d (YYYYMMDD) can no longer change, i.e., the
+    day ended more than settle_days ago
+    """
+    day = datetime.datetime.strptime(d, '%Y%m%d').date()
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    return day < today - datetime.timedelta(days=settle_days)
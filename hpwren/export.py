@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Export a model trained by test_lstm.py for CPU-only inference, as TorchScript
+# in fp32 and with its LSTM/GRU/Linear layers dynamically quantized to int8,
+# and optionally as ONNX (needs the onnx package). Each exported model is run
+# by infer.py in a fresh process, and its startup, latency, memory and MSE on
+# the held-out windows of test_lstm.py are reported against the fp32 model.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import warnings
+
+import numpy as np
+import torch
+
+from models import MODELS, build_model
+from train import load_series, make_splits
+
+
+def test_windows(table, win_size=24, test_frac=0.04):
+    """
+    The held-out windows of test_lstm.py
+
+    Returns:
+        windows: float32 tensor of (num_windows, win_size, 12)
+    """
+    return make_splits(load_series(table), win_size, 0, test_frac)[2]
+
+
+def quantize(model):
+    """Copy of model with its LSTM, GRU and Linear layers quantized to int8,
+    the activations are quantized on the fly"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # deprecation notice of torch.ao
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.LSTM, torch.nn.GRU, torch.nn.Linear},
+            dtype=torch.qint8)
+
+
+def export_torchscript(model, example, file_name):
+    """Trace and freeze model on an example batch and save it to file_name"""
+    with torch.inference_mode(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # tracer warnings of the rnn modules
+        traced = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+    torch.jit.save(traced, file_name)
+
+
+def export_onnx(model, example, file_name):
+    """Export model to ONNX with a dynamic batch size, returns False if the
+    onnx package is missing"""
+    try:
+        torch.onnx.export(model.eval(), (example,), file_name, dynamo=False,
+                          input_names=['x'], output_names=['y'],
+                          dynamic_axes={'x': {0: 'batch'}, 'y': {0: 'batch'}})
+    except (ImportError, torch.onnx.OnnxExporterError) as e:
+        print('ONNX export skipped: {}'.format(e))
+        return False
+    return True
+
+
+def run_exported(file_name, windows_file, pred_file, args):
+    """Run infer.py on an exported model in a new process, returns its report"""
+    runner = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'infer.py')
+    out = subprocess.run([sys.executable, runner, file_name, windows_file,
+                          '--output', pred_file, '--batch-size',
+                          str(args.batch_size), '--threads', str(args.threads),
+                          '--repeat', str(args.repeat), '--warmup',
+                          str(args.warmup), '--report'],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='lstm', choices=MODELS,
+                        help='the model')
+    parser.add_argument('--state-dict', type=str, default='global',
+                        help='weights of the model written by test_lstm.py')
+    parser.add_argument('--hidden-size', type=int, default=128,
+                        help='hidden size of the model')
+    parser.add_argument('--num-layers', type=int, default=1,
+                        help='number of layers of the recurrent models')
+    parser.add_argument('--ws', type=int, default=24,
+                        help='window size the model was trained with')
+    parser.add_argument('--table', type=str, default='2021/MG',
+                        help='table of the held-out windows')
+    parser.add_argument('--out', type=str, default='export',
+                        help='folder of the exported models and the report')
+    parser.add_argument('--onnx', action='store_true',
+                        help='also export the fp32 model to ONNX')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='batch size of the throughput measure')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of threads of the inference')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='number of single-window forecasts timed')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='number of forecasts run before timing')
+    args = parser.parse_args()
+
+    model = build_model(args.model, 12, args.hidden_size, 12, args.num_layers,
+                        args.ws - 1)
+    model.load_state_dict(torch.load(args.state_dict, map_location='cpu'))
+    model.eval()
+
+    os.makedirs(args.out, exist_ok=True)
+    windows = test_windows(args.table, args.ws)
+    x, gt = windows[:, :-1], windows[:, -1]
+    windows_file = os.path.join(args.out, 'test_x.npy')
+    np.save(windows_file, x.numpy())
+    example = x[:args.batch_size].contiguous()
+
+    exported = {}
+    exported['fp32'] = os.path.join(args.out, '{}.pt'.format(args.model))
+    export_torchscript(model, example, exported['fp32'])
+    exported['int8'] = os.path.join(args.out, '{}_int8.pt'.format(args.model))
+    export_torchscript(quantize(model), example, exported['int8'])
+    if args.onnx:
+        onnx_file = os.path.join(args.out, '{}.onnx'.format(args.model))
+        if export_onnx(model, example, onnx_file):
+            exported['onnx'] = onnx_file
+
+    with torch.inference_mode():
+        ref = model(x).numpy()
+    gt = gt.numpy()
+
+    report = {}
+    for variant, file_name in exported.items():
+        pred_file = os.path.join(args.out, 'pred_{}.npy'.format(variant))
+        try:
+            result = run_exported(file_name, windows_file, pred_file, args)
+        except subprocess.CalledProcessError as e:
+            print('{} failed to run: {}'.format(variant, e.stderr.strip()))
+            continue
+        pred = np.load(pred_file)
+        result['size_kb'] = os.path.getsize(file_name) / 1024
+        result['mse'] = float(np.mean((pred - gt) ** 2))
+        result['max_abs_diff_fp32'] = float(np.abs(pred - ref).max())
+        report[variant] = result
+
+    print('{} on {} held-out windows, eager fp32 MSE {:.5f}'.format(
+        args.model, len(gt), float(np.mean((ref - gt) ** 2))))
+    print('{:<6}{:>10}{:>11}{:>9}{:>9}{:>12}{:>10}{:>10}{:>12}'.format(
+        'model', 'size KB', 'startup s', 'p50 ms', 'p99 ms', 'windows/s',
+        'peak MB', 'MSE', 'diff fp32'))
+    for variant, r in report.items():
+        print('{:<6}{:>10.1f}{:>11.2f}{:>9.3f}{:>9.3f}{:>12.0f}{:>10.0f}'
+              '{:>10.5f}{:>12.2e}'.format(
+                  variant, r['size_kb'], r['startup_s'], r['p50_ms'] or 0,
+                  r['p99_ms'] or 0, r['windows_per_s'], r['peak_rss_mb'],
+                  r['mse'], r['max_abs_diff_fp32']))
+    with open(os.path.join(args.out, 'report.json'), 'w') as fp:
+        json.dump(report, fp, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Binary federated dataset written by read_data.py, one folder per split with
+# one .npy array per user and an index.json of the users and their number of
+# samples. The array of a user is the normalized series its windows are cut
+# from, so a user loads as memory-mapped views without materializing windows.
+# A split without win_size in its index, e.g., written by har/read_data.py,
+# holds the x and y of each user as <user>.x.npy and <user>.y.npy instead.
+# to_leaf_json converts a split to the LEAF json format when it is needed.
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from windows import WindowedSeries
+
+INDEX_FILE = 'index.json'
+
+
+def user_path(folder, user):
+    """Path of the array of a user"""
+    return os.path.join(folder, '{}.npy'.format(user))
+
+
+def user_files(folder, user, index):
+    """Paths of the arrays of a user"""
+    if 'win_size' in index:
+        return [user_path(folder, user)]
+    return [os.path.join(folder, '{}.{}.npy'.format(user, v)) for v in 'xy']
+
+
+def write_user(folder, user, series):
+    """
+    Write the series of a user, through a temporary file
+
+    Args:
+        folder: folder of the split
+        user: the user name
+        series: the normalized series of the user, (T, num_features)
+    """
+    os.makedirs(folder, exist_ok=True)
+    file_path = user_path(folder, user)
+    with open(file_path + '.part', 'wb') as f:
+        np.save(f, np.ascontiguousarray(series))
+    os.replace(file_path + '.part', file_path)
+
+
+def write_index(folder, users, num_samples, win_size):
+    """
+    Write the index of a split, once the arrays of all its users are written
+
+    Args:
+        folder: folder of the split
+        users: list of the user names
+        num_samples: number of windows of each user
+        win_size: window size, the first win_size-1 samples of a window are x
+            and the last one is y
+    """
+    os.makedirs(folder, exist_ok=True)
+    index = {'users': list(users), 'num_samples': [int(n) for n in num_samples],
+             'win_size': win_size}
+    with open(os.path.join(folder, INDEX_FILE), 'w') as fp:
+        json.dump(index, fp, indent=4)
+
+
+def load_index(folder):
+    """Load the index of a split, a dictionary with 'users', 'num_samples' and
+    'win_size'"""
+    with open(os.path.join(folder, INDEX_FILE), 'r') as fp:
+        return json.load(fp)
+
+
+def load_windows(folder, user, win_size, mmap=True):
+    """WindowedSeries of a user, viewing its memory-mapped series"""
+    series = np.load(user_path(folder, user), mmap_mode='r' if mmap else None)
+    return WindowedSeries(series, win_size)
+
+
+def load_user(folder, user, index=None, mmap=True):
+    """
+    Load the data of a single user
+
+    Args:
+        folder: folder of the split
+        user: the user name
+        index: the index of the split, loaded if None
+        mmap: if True, the series is memory-mapped and only the windows that
+            are used get read
+    Returns:
+        x, y: arrays of (num_samples, win_size-1, num_features) and
+            (num_samples, num_features), views of the series
+    """
+    if index is None:
+        index = load_index(folder)
+    if 'win_size' not in index:
+        x_file, y_file = user_files(folder, user, index)
+        mmap_mode = 'r' if mmap else None
+        return np.load(x_file, mmap_mode=mmap_mode), \
+            np.load(y_file, mmap_mode=mmap_mode)
+    windows = load_windows(folder, user, index['win_size'], mmap)
+    return windows.x, windows.y
+
+
+def to_leaf_json(folder, file_name):
+    """
+    Convert a split to a LEAF json file with 'users', 'user_data' and
+    'num_samples', as read_data.py used to write
+
+    The users are written one after another, so only the lists of one user
+    are in memory at a time.
+    """
+    index = load_index(folder)
+    with open(file_name, 'w') as fp:
+        fp.write('{{"users": {}, "num_samples": {}, "user_data": {{'.format(
+            json.dumps(index['users']), json.dumps(index['num_samples'])))
+        for i, user in enumerate(index['users']):
+            x, y = load_user(folder, user, index)
+            fp.write('{}{}: '.format(', ' if i else '', json.dumps(user)))
+            json.dump({'x': x.tolist(), 'y': y.tolist()}, fp)
+        fp.write('}}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='convert a split written by read_data.py to LEAF json')
+    parser.add_argument('folder', help='folder of the split, e.g., train')
+    parser.add_argument('file_name', help='json file to write, e.g., train.json')
+    args = parser.parse_args()
+
+    to_leaf_json(args.folder, args.file_name)
+    print('{} converted to {}'.format(args.folder, args.file_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# On-disk cache of the HTTP responses of the HPWREN site, so that querying
+# again with another header or file pattern needs no network at all.
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a url is not in the cache"""
+
+
+class HTTPCache:
+    """
+    Compressed cache of response bodies keyed by url, with LRU eviction
+
+    Each entry is a gzip file of the body and a json file of the url and the
+    headers worth keeping. The modification time of an entry is the time it
+    was fetched and its access time is set on every hit, which orders the
+    least recently used entries for eviction. The size of an entry counts both
+    files.
+
+    Args:
+        folder: directory of the cache
+        max_bytes: the least recently used entries are evicted above this size
+        ttl: seconds a page that may still change, e.g., the listing or raw
+            file of today, stays valid
+        offline: if True, never fetch, a missing url raises CacheMiss
+    """
+
+    # headers stored with each body
+    HEADERS = ('Content-Length', 'Last-Modified', 'Content-Type')
+
+    def __init__(self, folder, max_bytes=2*1024**3, ttl=3600, offline=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.size = sum(self._entry_size(entry.path[:-len('.gz')])
+                        for entry in self._entries())
+
+    def _entries(self):
+        for sub in os.scandir(self.folder):
+            if sub.is_dir():
+                yield from (entry for entry in os.scandir(sub.path)
+                            if entry.name.endswith('.gz'))
+
+    @staticmethod
+    def _entry_size(path):
+        # bytes of the body and headers of an entry, 0 for a missing file
+        size = 0
+        for ext in ('.gz', '.json'):
+            try:
+                size += os.path.getsize(path + ext)
+            except OSError:
+                pass
+        return size
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, url, mutable=False):
+        """
+        Get a cached response
+
+        Args:
+            url: the url of the response
+            mutable: if True, the page may still change and expires after ttl
+                seconds, unless the cache is offline
+        Returns:
+            content, headers: the body in bytes and a dictionary of headers,
+                or None, None if the url is not cached or expired
+        """
+        path = self._path(url)
+        try:
+            fetched = os.path.getmtime(path + '.gz')
+            if mutable and not self.offline and time.time() - fetched > self.ttl:
+                return None, None
+            with gzip.open(path + '.gz', 'rb') as f:
+                content = f.read()
+            with open(path + '.json', 'r') as fp:
+                headers = json.load(fp)['headers']
+        except (OSError, ValueError):  # not cached, or evicted meanwhile
+            return None, None
+        os.utime(path + '.gz', (time.time(), fetched))  # mark as recently used
+        return content, headers
+
+    def put(self, url, content, headers):
+        """Store a response, evicting the least recently used entries if full"""
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}'.format(path, threading.get_ident())
+        with gzip.open(tmp + '.gz.part', 'wb', compresslevel=6) as f:
+            f.write(content)
+        with open(tmp + '.json.part', 'w') as fp:
+            json.dump({'url': url,
+                       'headers': {h: headers[h] for h in self.HEADERS
+                                   if h in headers}}, fp)
+        size = os.path.getsize(tmp + '.gz.part') + \
+            os.path.getsize(tmp + '.json.part')
+        with self.lock:
+            # the body goes first and the headers last, and eviction removes
+            # them the other way round, so headers never lack their body
+            self.size -= self._entry_size(path)
+            os.replace(tmp + '.gz.part', path + '.gz')
+            os.replace(tmp + '.json.part', path + '.json')
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # evict down to 90% of the bound, so that eviction does not run on
+        # every put once the cache is full
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_atime)
+        for entry in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            path = entry.path[:-len('.gz')]
+            self.size -= self._entry_size(path)
+            for ext in ('.json', '.gz'):
+                try:
+                    os.remove(path + ext)
+                except FileNotFoundError:  # e.g., a put stopped midway
+                    pass
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Standalone forecasting with a model exported by export.py, for gateways that
+# only need to run inference. A TorchScript model loads without models.py and
+# the training dependencies; an ONNX model runs with onnxruntime if installed.
+
+import time
+START = time.perf_counter()
+
+import argparse
+import json
+import resource
+import warnings
+
+import numpy as np
+
+
+def load(model_path):
+    """Load an exported model, returns a function of a (b, T, c) float32
+    array to the (b, c) forecasts"""
+    if model_path.endswith('.onnx'):
+        import onnxruntime
+        session = onnxruntime.InferenceSession(
+            model_path, providers=['CPUExecutionProvider'])
+        name = session.get_inputs()[0].name
+        return lambda x: session.run(None, {name: x})[0]
+
+    import torch
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # deprecation notice of torch.jit
+        model = torch.jit.load(model_path, map_location='cpu')
+
+    def run(x):
+        with torch.inference_mode():
+            return model(torch.from_numpy(x)).numpy()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='forecast windows with a model exported by export.py')
+    parser.add_argument('model', help='the exported model, .pt or .onnx')
+    parser.add_argument('windows', help='.npy of the input windows, '
+                                        '(num_windows, win_size-1, 12)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='.npy file of the forecasts')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='number of windows forecast at once')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of intra-op threads')
+    parser.add_argument('--repeat', type=int, default=0,
+                        help='number of single-window forecasts timed for '
+                             'the latency percentiles')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='number of forecasts run before timing')
+    parser.add_argument('--report', action='store_true',
+                        help='print the timings and memory as json')
+    args = parser.parse_args()
+
+    if not args.model.endswith('.onnx'):
+        import torch
+        torch.set_num_threads(args.threads)
+    windows = np.load(args.windows).astype(np.float32, copy=False)
+    run = load(args.model)
+    startup = time.perf_counter() - START
+
+    for i in range(min(args.warmup, len(windows))):
+        run(windows[i:i + 1])
+
+    # latency of a single window, as in live forecasting
+    latency = []
+    for i in range(args.repeat):
+        x = windows[i % len(windows):i % len(windows) + 1]
+        st = time.perf_counter()
+        run(x)
+        latency.append(time.perf_counter() - st)
+
+    # throughput of the whole set by batches
+    st = time.perf_counter()
+    pred = np.concatenate([run(windows[b:b + args.batch_size])
+                           for b in range(0, len(windows), args.batch_size)])
+    total = time.perf_counter() - st
+
+    if args.output is not None:
+        np.save(args.output, pred)
+    report = {'startup_s': startup,
+              'p50_ms': 1000 * float(np.percentile(latency, 50)) if latency else None,
+              'p99_ms': 1000 * float(np.percentile(latency, 99)) if latency else None,
+              'windows_per_s': len(windows) / total,
+              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if args.report:
+        print(json.dumps(report))
+    else:
+        print('startup {:.2f}s, {:.0f} windows/s, peak memory {:.0f} MB'.format(
+            startup, report['windows_per_s'], report['peak_rss_mb']))
+
+
+if __name__ == "__main__":
+    main()
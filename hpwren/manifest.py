@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Manifest of the raw HPWREN files fetched into a year directory.
+# Every fetched file is appended to a json-lines journal right after its csv is
+# written, so an interrupted query resumes from the last finished file.
+
+import json
+import os
+import threading
+
+
+class Manifest:
+    """
+    Record of each fetched day file, keyed by the path of its csv
+
+    Each record holds the url, size, last-modified time and sha256 of the raw
+    file, the header it was parsed with and whether the file is final.
+
+    Args:
+        path: path of the journal file, e.g., 2021/manifest.jsonl
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # last line cut short by a crash
+                        continue
+                    self.entries[record['file']] = record
+
+    def get(self, file_path):
+        return self.entries.get(file_path)
+
+    def update(self, file_path, record):
+        """Record a fetched file and append it to the journal"""
+        record = dict(record, file=file_path)
+        with self.lock:
+            self.entries[file_path] = record
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def compact(self):
+        """Rewrite the journal with only the latest record of each file"""
+        with self.lock:
+            with open(self.path + '.part', 'w') as f:
+                for file_path in sorted(self.entries):
+                    f.write(json.dumps(self.entries[file_path]) + '\n')
+            os.replace(self.path + '.part', self.path)
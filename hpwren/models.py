@@ -29,6 +29,12 @@ class RNN(nn.Module):
 
         return out
 
+    def step(self, x, state=None):
+        # Advance the hidden state by one observation x of (b, input_size),
+        # returns the forecast after it and the new state
+        out, state = self.rnn(x.unsqueeze(1), state)
+        return self.fc(out[:, -1, :]), state
+
 class LSTM(nn.Module):
 
     def __init__(self, input_size, hidden_size, output_size, num_layers, device):
@@ -49,16 +55,19 @@ class LSTM(nn.Module):
 
     def forward(self, x):
 
-        h_0 = torch.zeros(self.num_layers, x.shape[0], self.hidden_size).to(self.device)
-        c_0 = torch.zeros(self.num_layers, x.shape[0], self.hidden_size).to(self.device)
-
-        out, (h_out, c_out) = self.lstm(x, (h_0, c_0))  # b, t, output_size   
+        # the initial states default to zeros on the device of x
+        out, (h_out, c_out) = self.lstm(x)  # b, t, hidden_size
 
-        out = self.fc(out)   
-        out = out[:, -1, :]
+        out = self.fc(out[:, -1, :])  # only the last step is forecast
 
         return out
 
+    def step(self, x, state=None):
+        # Advance the hidden state (h, c) by one observation x of
+        # (b, input_size), returns the forecast after it and the new state
+        out, state = self.lstm(x.unsqueeze(1), state)
+        return self.fc(out[:, -1, :]), state
+
 class GRU(nn.Module):
     def __init__(self, input_size, hidden_size, output_size, num_layers):
         super(GRU, self).__init__()
@@ -82,6 +91,12 @@ class GRU(nn.Module):
 
         return out
 
+    def step(self, x, state=None):
+        # Advance the hidden state by one observation x of (b, input_size),
+        # returns the forecast after it and the new state
+        out, state = self.gru(x.unsqueeze(1), state)
+        return self.fc(out[:, -1, :]), state
+
 class CNN(nn.Module):
     def __init__(self, input_size, hidden_size, output_size, seq_len):
         super(CNN, self).__init__()
@@ -117,4 +132,24 @@ class MLP(nn.Module):
         out = self.fc2(out) #b,t,c
         out = self.fc3(out.permute(0,2,1)) #b,c,1
 
-        return out.squeeze()
\ No newline at end of file
+        return out.squeeze(-1) #b,c, also for a batch of one
+
+MODELS = ['rnn', 'lstm', 'gru', 'cnn', 'mlp']
+
+def build_model(name, input_size, hidden_size, output_size, num_layers=1,
+                seq_len=23, device=torch.device('cpu')):
+    # Build a model by name, seq_len is the number of input steps (win_size-1)
+    # used by the CNN and MLP, num_layers by the recurrent models
+    if name == 'rnn':
+        model = RNN(input_size, hidden_size, output_size, num_layers)
+    elif name == 'lstm':
+        model = LSTM(input_size, hidden_size, output_size, num_layers, device)
+    elif name == 'gru':
+        model = GRU(input_size, hidden_size, output_size, num_layers)
+    elif name == 'cnn':
+        model = CNN(input_size, hidden_size, output_size, seq_len)
+    elif name == 'mlp':
+        model = MLP(input_size, hidden_size, output_size, seq_len)
+    else:
+        raise ValueError('Unknown model {}'.format(name))
+    return model.to(device)
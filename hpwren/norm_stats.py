@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streaming mean and standard deviation of the HPWREN location tables, used to
+# normalize the data in read_data.py. Each table is read once in chunks, the
+# partial statistics are merged (Chan et al.) and saved next to the data.
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from table_io import iter_chunks, list_tables
+
+STATS_FILE = 'norm_stats.json'
+
+
+class RunningStats:
+    """
+    Per-column count, mean and sum of squared deviations, ignoring nans
+
+    Args:
+        num_columns: number of columns
+    """
+
+    def __init__(self, num_columns):
+        self.count = np.zeros(num_columns)
+        self.mean = np.zeros(num_columns)
+        self.m2 = np.zeros(num_columns)
+
+    def update(self, x):
+        """Add the rows of x, (num_rows, num_columns)"""
+        x = np.asarray(x, dtype=float)
+        valid = ~np.isnan(x)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, x, 0).sum(axis=0) / count
+        m2 = np.where(valid, (x - mean) ** 2, 0).sum(axis=0)
+        self._merge(count, np.nan_to_num(mean), m2)
+
+    def merge(self, other):
+        """Add the statistics of another RunningStats"""
+        self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            new_mean = np.where(total > 0,
+                                self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 +
+                               delta ** 2 * self.count * count / total, 0)
+        self.mean = new_mean
+        self.count = total
+
+    def result(self):
+        """Mean and (population) standard deviation, nan for empty columns"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            empty = self.count == 0
+            mean = np.where(empty, np.nan, self.mean)
+            std = np.where(empty, np.nan, np.sqrt(self.m2 / self.count))
+        return mean, std
+
+
+def table_stats(file_name, chunk_rows=100000):
+    """
+    Statistics of the readings of one table, only over its complete rows as
+    read_data uses them
+
+    Returns:
+        stats: RunningStats of the readings, i.e., all columns but the first 4
+    """
+    stats = None
+    for df in iter_chunks(file_name, chunk_rows):
+        data = df.dropna().values[:, 4:]  # Get rid of data info
+        if stats is None:
+            stats = RunningStats(data.shape[1])
+        stats.update(data)
+    return stats
+
+
+def signature(files):
+    """Size and modification time of each file, to detect changed data"""
+    return {os.path.basename(f): [os.path.getsize(f), os.path.getmtime(f)]
+            for f in files}
+
+
+def get_norm_stats(folder, processes=1, chunk_rows=100000, refresh=False):
+    """
+    Mean and standard deviation of the readings of all tables of a folder,
+    reused from folder/norm_stats.json unless the tables changed
+
+    Args:
+        folder: folder of the location tables, e.g., ./2021
+        processes: number of processes reading tables in parallel
+        chunk_rows: number of rows read at once from a table
+        refresh: if True, compute the statistics even if saved ones are valid
+    Returns:
+        mean, std: arrays of one value per reading
+    """
+    files = list_tables(folder)
+    stats_path = os.path.join(folder, STATS_FILE)
+    if not refresh and os.path.exists(stats_path):
+        with open(stats_path, 'r') as fp:
+            saved = json.load(fp)
+        if saved['files'] == signature(files):
+            return np.array(saved['mean'], dtype=float), \
+                np.array(saved['std'], dtype=float)
+
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            partials = list(pool.map(table_stats, files,
+                                     [chunk_rows] * len(files)))
+    else:
+        partials = [table_stats(f, chunk_rows) for f in files]
+
+    # merge in the order of the files, so the result does not depend on
+    # the number of processes
+    stats = None
+    for partial in partials:
+        if partial is None:
+            continue
+        if stats is None:
+            stats = RunningStats(len(partial.count))
+        stats.merge(partial)
+    if stats is None:
+        raise ValueError('No table found in {}'.format(folder))
+    mean, std = stats.result()
+    print('Number of complete samples in {}: {}'.format(folder,
+                                                        int(stats.count.max())))
+
+    with open(stats_path, 'w') as fp:
+        json.dump({'files': signature(files), 'count': stats.count.tolist(),
+                   'mean': mean.tolist(), 'std': std.tolist()}, fp, indent=4)
+    return mean, std
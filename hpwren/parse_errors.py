@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Accounting of the anomalies met while parsing raw HPWREN files.
+# The parsers collect the anomalies of a file and merge them here once per
+# file, so nothing is printed per sample and one summary is reported at the end.
+
+import json
+import threading
+from collections import Counter
+
+import numpy as np
+
+# kinds of anomalies
+# missing: a requested reading is not reported by a sample
+# malformed: the value of a reading holds no number
+# bad_line: a line without time stamp or readings, skipped
+KINDS = ('missing', 'malformed', 'bad_line')
+
+
+class ParseErrors:
+    """
+    Counts of parse anomalies by station, day, field and kind, with a bounded
+    sample of example lines for each kind
+
+    Args:
+        max_examples: number of example lines kept for each kind
+    """
+
+    def __init__(self, max_examples=20):
+        self.max_examples = max_examples
+        self.counts = Counter()  # (station, day, field, kind) -> count
+        self.examples = {kind: [] for kind in KINDS}
+        self.samples = Counter()  # station -> number of samples parsed
+        self.files = Counter()  # station -> number of files parsed
+        self.lock = threading.Lock()
+
+    def add_file(self, station, day, header, fileData, anomalies, lines=None):
+        """
+        Merge the anomalies of one parsed file
+
+        Args:
+            station: the location of the file
+            day: the day of the file, YYYYMMDD
+            header: header of the parsed data
+            fileData: the parsed array of (num_samples, len(header))
+            anomalies: list of (kind, field, line) collected by the parser
+            lines: the raw line of each row of fileData, to keep examples of
+                missing readings, None to keep none
+        """
+        # a nan that is not a malformed value is a missing reading
+        isnan = np.isnan(fileData)
+        nans = isnan.sum(axis=0)
+        malformed = Counter(field for kind, field, _ in anomalies
+                            if kind == 'malformed')
+        with self.lock:
+            self.samples[station] += fileData.shape[0]
+            self.files[station] += 1
+            for i, h in enumerate(header):
+                missing = int(nans[i]) - malformed[h]
+                if h != 't' and missing > 0:
+                    self.counts[(station, day, h, 'missing')] += missing
+                    if lines is not None:
+                        self._add_missing_examples(
+                            station, day, h, isnan[:, i], lines, anomalies)
+            for kind, field, line in anomalies:
+                self.counts[(station, day, field, kind)] += 1
+                if len(self.examples[kind]) < self.max_examples:
+                    self.examples[kind].append(
+                        {'station': station, 'day': day, 'field': field,
+                         'line': line[:200]})
+
+    def _add_missing_examples(self, station, day, field, isnan, lines,
+                              anomalies):
+        # only looks at the rows of a field until the examples are full
+        examples = self.examples['missing']
+        if len(examples) >= self.max_examples:
+            return
+        malformed = {line for kind, f, line in anomalies
+                     if kind == 'malformed' and f == field}
+        for row in np.flatnonzero(isnan):
+            if len(examples) >= self.max_examples:
+                break
+            if lines[row] not in malformed:
+                examples.append({'station': station, 'day': day,
+                                 'field': field, 'line': lines[row][:200]})
+
+    def totals(self):
+        """Total count of each kind"""
+        totals = Counter()
+        for (_, _, _, kind), count in self.counts.items():
+            totals[kind] += count
+        return totals
+
+    def by_station_field(self):
+        """Counts and number of days of each (station, field, kind)"""
+        counts, days = Counter(), Counter()
+        for (station, day, field, kind), count in self.counts.items():
+            counts[(station, field, kind)] += count
+            days[(station, field, kind)] += 1
+        return counts, days
+
+    def report(self, top=20):
+        """Summary of the anomalies, as a printable string"""
+        lines = ['parse anomalies over {} files, {} samples:'.format(
+            sum(self.files.values()), sum(self.samples.values()))]
+        totals = self.totals()
+        if not totals:
+            lines.append('  none')
+            return '\n'.join(lines)
+        for kind in KINDS:
+            lines.append('  {}: {}'.format(kind, totals[kind]))
+
+        counts, days = self.by_station_field()
+        lines.append('  by station and field (top {}):'.format(top))
+        for (station, field, kind), count in counts.most_common(top):
+            lines.append('    {} {} {}: {} of {} samples ({:.1f}%) on {} of '
+                         '{} days'.format(
+                station, field, kind, count, self.samples[station],
+                100.0 * count / max(self.samples[station], 1),
+                days[(station, field, kind)], self.files[station]))
+
+        for kind in KINDS:
+            for example in self.examples[kind]:
+                lines.append('  example {} {} {} {}: {}'.format(
+                    kind, example['station'], example['day'],
+                    example['field'], example['line']))
+        return '\n'.join(lines)
+
+    def to_json(self, file_name):
+        """Dump the counts and examples to a json file"""
+        counts = [{'station': station, 'day': day, 'field': field,
+                   'kind': kind, 'count': count}
+                  for (station, day, field, kind), count in
+                  sorted(self.counts.items())]
+        with open(file_name, 'w') as fp:
+            json.dump({'totals': dict(self.totals()),
+                       'samples': dict(self.samples),
+                       'files': dict(self.files),
+                       'counts': counts,
+                       'examples': self.examples}, fp, indent=4)
@@ -9,8 +9,6 @@
 # In[1]:
 
 
-import requests
-from pprint import pprint #import pretty print
 from bs4 import BeautifulSoup
 import re
 import csv
@@ -18,17 +16,18 @@ import datetime
 import numpy as np
 import os
 import shutil
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 ###############################
 # Necessary functions
 ###############################
-def get_sub_dir(url, pattern):
+def parse_dir_listing(page, pattern):
     '''
-    Get a list of url of all the subdirectories under the given url
-    that satisfy the given patterns
+    Parse the subdirectories of an index page that satisfy the given pattern
     '''
-    page = requests.get(url).text
     soup = BeautifulSoup(page, 'html.parser')
     sub_dirs = [node.get('href') for node in soup.find_all('a')]
     sub_dirs = [node.strip('./') for node in sub_dirs] # filter out irrelevant characters
@@ -39,56 +38,110 @@ def get_sub_dir(url, pattern):
     sub_dirs = [node for node in sub_dirs if (re.search(pattern, node) is not None)]
     return [node for node in sub_dirs]
 
-def align_data(header, reading, value):
+
+# leading number of a reading value, e.g., 16.2 in Ta=16.2C
+NUMBER = re.compile(r'[\d.-]*')
+
+
+def make_sample_parser(header, anomalies):
     '''
-    Align the reading-value with the provided header, adding nans to non-appear headers
+    Make a function that parses one raw sample line into a row of readings
+    aligned with the header, adding nans to non-appear headers
+
+    The 't' column of the row holds the raw unix time of the sample. Lines
+    that cannot be parsed give None. The anomalies met are appended to the
+    list anomalies as (kind, field, line), see parse_errors.py
     '''
-    fileData = []
-    for i in range(len(header)):
-        try: # try to find the index of current header in the reading list
-            idx = reading.index(header[i])
-            fileData.append(value[idx])
-        except Exception as e: # current header not in the reading list
-            print('Error: {}'.format(e))
-            print('Current header {} not in the list of {}'.format(header[i], reading))
-            fileData.append(float("nan"))
-    return fileData
+    # map each header to its column once instead of searching every sample
+    column = {h: i for i, h in enumerate(header)}
+    timeColumn = column.pop('t', None)
+    nan = float('nan')
+    match = NUMBER.match
+
+    def parse_sample(sample):
+        fields = sample.split('\t')
+        row = [nan] * len(header)
+        try:
+            time_stamp = int(fields[2])
+            records = fields[3].strip('0R0,').split(',')
+        except (IndexError, ValueError):
+            anomalies.append(('bad_line', '', sample))
+            return None
+        if timeColumn is not None:
+            row[timeColumn] = time_stamp
+
+        for ele in records:
+            reading, _, value = ele.partition('=')
+            col = column.get(reading)
+            if col is None:  # reading not requested
+                continue
+            try:
+                row[col] = float(match(value).group())
+            except ValueError:
+                anomalies.append(('malformed', reading, sample))
+        return row
+
+    return parse_sample
 
 
-def parse_file(fileURL, header):
+def parse_page(page, header, errors=None, station='', day=''):
     '''
-    Parse the time and data from file url
-    Only take the data from the specified header
+    Parse the time and data from the text of a raw data file
+    Only take the data from the specified header, adding nans to non-appear headers
+
+    Args:
+        page: text of the raw data file
+        header: the readings to keep
+        errors: ParseErrors accounting the anomalies, None to ignore them
+        station, day: location and day of the file, to account the anomalies
+    Returns:
+        fileData: array of (num_samples, len(header)), the 't' column holds
+            the seconds since the first sample
     '''
-    from itertools import compress
-    fileData = []
-    page = requests.get(fileURL).text
     samples = page.strip().split('\n')
-    fileTime = [int(sample.split('\t')[2]) for sample in samples]
-    startTime = fileTime[0]
-    fileTime = [t - startTime for t in fileTime]
-    dataString = [sample.split('\t')[3] for sample in samples]
-    for idx in range(len(dataString)):
-        dataPhrase = dataString[idx].strip('0R0,').split(',')
-
-        reading, value = [], []
-        for ele in dataPhrase:
-            try:
-                record = ele.split('=')
-                # extract headers in the record
-                reading.append(record[0])
-                # extract values in the record
-                value.append(float(re.findall(r'[\d.-]*', record[1])[0]))
-            except Exception as e:
-                print('Error: {}'.format(e))
-                print('At time {}'.format(fileTime[idx] + startTime))
-                print('Original phrase: {}'.format(dataPhrase))
-                print('Original record: {}'.format(record))
-
-        reading.insert(0, 't') # insert time header at the beginning
-        value.insert(0, fileTime[idx]) # insert time stamp at the beginning
-        fileData.append(align_data(header, reading, value))
+    anomalies = []
+    parse_sample = make_sample_parser(header, anomalies)
+    fileData = np.empty((len(samples), len(header)))
+    lines = []  # the line of each row, for the examples of missing readings
+    for sample in samples:
+        row = parse_sample(sample)
+        if row is not None:
+            fileData[len(lines)] = row
+            lines.append(sample)
+    fileData = fileData[:len(lines)]
+    if errors is not None:
+        errors.add_file(station, day, header, fileData, anomalies, lines)
+    return start_time_at_zero(header, fileData)
+
+
+def parse_lines(lines, header, errors=None, station='', day=''):
+    '''
+    Parse the time and data from the lines of a raw data file as they are
+    streamed, e.g., from Response.iter_lines()
 
+    Returns:
+        fileData: array of (num_samples, len(header)), as parse_page
+    '''
+    anomalies = []
+    parse_sample = make_sample_parser(header, anomalies)
+    rows, kept = [], []
+    for line in lines:
+        if line.strip():
+            row = parse_sample(line)
+            if row is not None:
+                rows.append(row)
+                kept.append(line)
+    fileData = np.array(rows, dtype=float).reshape((-1, len(header)))
+    if errors is not None:
+        errors.add_file(station, day, header, fileData, anomalies, kept)
+    return start_time_at_zero(header, fileData)
+
+
+def start_time_at_zero(header, fileData):
+    '''Shift the 't' column to the seconds since the first sample'''
+    if 't' in header and len(fileData):
+        col = header.index('t')
+        fileData[:, col] -= fileData[0, col]
     return fileData
 
 
@@ -118,42 +171,32 @@ year = ['2021'] # year of data to request
 filePattern = ":0R0:4:0"
 header = ['t', 'Dn', 'Dm', 'Dx', 'Sn', 'Sm', 'Sx', 'Ta', 'Ua', 'Pa', 'Rc', 'Rd', 'Ri'] # type of sensor readings to request
 
-for y in year:
-    # remove existing folder (if exists) and create a new folder for the given year
-    if os.path.exists(y):
+def query_year(crawler, y, full=False):
+    """
+    Query the raw files of a year and store them as year/loc/day.csv
+
+    Only the files that are new or changed since the last query are
+    downloaded, as recorded in year/manifest.jsonl
+
+    Args:
+        crawler: the Crawler used to fetch listings and files
+        y: the year to query, str
+        full: if True, remove the existing folder and query everything again
+    Returns:
+        written: list of the csv files written
+    """
+    from manifest import Manifest
+
+    # remove existing folder (if asked) and create the folder for the given year
+    if full and os.path.exists(y):
         shutil.rmtree(y)
-    os.makedirs(y)
-    
-    # query days from the year's url
-    yearURL = baseURL + y + '/'
-    dayPattern = y + '\d*'
-    days = get_sub_dir(yearURL, dayPattern)
-    if not len(days):
-        print('yearURL {} is empty!'.format(yearURL))
-        continue
-    
-    # query the files for each day
-    for d in days:
-        dayURL = yearURL + d + '/'
-        files = get_sub_dir(dayURL, filePattern)
-        if not len(files):
-            print('dayURL {} is empty!'.format(dayURL))
-            continue
-            
-        # query the data in each file
-        for f in files:
-            fileURL = dayURL + f
-            print('querying file {}'.format(fileURL))
-            fileData = parse_file(fileURL, header)
-            
-            # create a folder for the location if first-time appears
-            loc = f.split(':')[1].split('-')[0]
-            if not os.path.exists(y + '/' + loc):
-                os.makedirs(y + '/' + loc)
-                
-            # write queried data to csv
-            filepath = '{}/{}/{}.csv'.format(y, loc, d)
-            write_csv(filepath, header, fileData)
+    os.makedirs(y, exist_ok=True)
+
+    manifest = Manifest(os.path.join(y, 'manifest.jsonl'))
+    written = crawler.crawl_year(baseURL, y, filePattern, header, manifest)
+    manifest.compact()
+    print('{} files queried for year {}'.format(len(written), y))
+    return written
 
 
 # 2. Average and reorganze data. Store the formatted data under the year's
@@ -182,77 +225,171 @@ def read_file(file_path, interval, day_sample_num):
         data: dictionary of export data, list
     """
     print('reading file {}'.format(file_path))
-    data = {}
     with open(file_path, 'r', newline='') as incsv:
-        reader = csv.reader(incsv, delimiter=',')
-        header = next(reader)
-        # add headers as keys in data dict
-        for h in header:
-            # init the readings to nan
-            data[h] = np.empty(day_sample_num)
-            data[h][:] = np.nan
-
-        data_stack = []
-        time_stamp = 0.0 # record the current time stamp for data_stack
-        for row in reader:
-            new_data = [float(d) for d in row]
-            cur_time = new_data[0]
-            # if the time exceeds one single day, the data becomes invalid
-            if cur_time > 24*3600:
-                break
-            # append existing data_stack to dict if an interval is loaded
-            if cur_time >= time_stamp + interval*60:
-                # calculate the index to put this averaged data based on the time stamp
-                idx = int(time_stamp/60/interval)
-                data_stack = np.around(np.mean(np.array(data_stack), axis=0), 2)
-                data_stack[0] = time_stamp # fill in the first time stamp
-                # print('time stamp: {}'.format(time_stamp))
-                for i in range(len(header)):
-                    data[header[i]][idx] = data_stack[i]
-                data_stack = []
-                time_stamp += interval*60 # add seconds equivalent to interval in minutes
-
-            # append the new data to the data_stack
-            data_stack.append(new_data)
-
-        # process the last chunk of data if not processed
-        if len(data_stack) > 0 and time_stamp < 24*3600:
-            idx = int(time_stamp/60/interval)
-            data_stack = np.around(np.mean(np.array(data_stack), axis=0), 2)
-            data_stack[0] = time_stamp
-            for i in range(len(header)):
-                data[header[i]][idx] = data_stack[i]
+        header = next(csv.reader(incsv, delimiter=','))
+        fileData = np.loadtxt(incsv, delimiter=',', ndmin=2).reshape(
+            (-1, len(header)))
+
+    return header, average_day(header, fileData, interval, day_sample_num,
+                               file_path)
+
+
+def average_day(header, fileData, interval, day_sample_num, name=''):
+    """
+    Average the samples of one day into intervals
+
+    Args:
+        header: header of the samples, the first one is the time 't'
+        fileData: rows of samples, as parse_page or read from a day csv file
+        interval: number of minutes per sample
+        day_sample_num: number of samples per day
+        name: name of the day data in error messages
+    Returns:
+        data: dictionary of export data
+    """
+    averaged = resample(fileData, intervals=(interval,))[interval]['mean']
+    data = {h: averaged[:, i] for i, h in enumerate(header)}
 
     # validation check on length of data
     for h in data:
         assert(data[h].shape[0] == day_sample_num), 'Incorrect length for ' \
-            'file {} header {}: should be {} but is {}'.format(file_path, h,
+            'file {} header {}: should be {} but is {}'.format(name, h,
             day_sample_num, data[h].shape[0])
 
-    return header, data
+    return data
+
+
+# aggregations supported by resample
+# mean: mean of the bin, nan if any sample of the bin is nan
+# nanmean, min, max: ignore the nan samples of the bin
+# last: the last sample of the bin
+AGGREGATIONS = ('mean', 'nanmean', 'min', 'max', 'last')
+
+
+def bin_sum(samples, starts, ends):
+    """
+    Sum the rows of each contiguous bin samples[starts[i]:ends[i]]
+
+    Bins of the same length are gathered and reduced together, which keeps
+    the summation order, and so the rounding, of np.mean over a single bin.
+    np.add.reduceat sums in another order and may differ in the last bit.
+    """
+    lengths = ends - starts
+    sums = np.empty((len(starts), samples.shape[1]))
+    for length in np.unique(lengths):
+        sel = np.flatnonzero(lengths == length)
+        rows = starts[sel, None] + np.arange(length)
+        sums[sel] = np.add.reduce(samples[rows], axis=1)
+    return sums
+
+
+def resample(fileData, intervals=(60,), aggs=('mean',), decimals=2):
+    """
+    Resample the samples of one day into bins of several intervals at once
+
+    Samples are binned by the integer division of their time by the interval
+    and every bin is reduced at once (ufunc.reduceat, bin_sum), so that no
+    Python loop runs over the samples. Samples after 24 hours are dropped.
+    Unlike the former row-by-row loop, samples after a gap of several
+    intervals go to the bin of their own time stamp.
+
+    Args:
+        fileData: rows of samples, the first column is the time in seconds
+            since the first sample, as parse_page
+        intervals: number of minutes per bin, e.g., (10, 30, 60, 24*60)
+        aggs: aggregations to compute, from AGGREGATIONS
+        decimals: the means are rounded to this number of decimals
+    Returns:
+        bins: dictionary of {interval: {agg: array of
+            (24*60/interval, num_columns)}}, the first column holds the start
+            time of each non-empty bin and empty bins are nans
+    """
+    for agg in aggs:
+        assert(agg in AGGREGATIONS), 'Unknown aggregation {}'.format(agg)
+    fileData = np.asarray(fileData, dtype=float)
+    # if the time exceeds one single day, the data becomes invalid
+    late = np.flatnonzero(fileData[:, 0] > 24*3600)
+    if len(late):
+        fileData = fileData[:late[0]]
+    if np.any(np.diff(fileData[:, 0]) < 0):
+        fileData = fileData[np.argsort(fileData[:, 0], kind='stable')]
+    isnan = np.isnan(fileData)
+
+    bins = {}
+    for interval in intervals:
+        day_sample_num = int(24*60/interval)
+        idx = (fileData[:, 0] // (interval*60)).astype(int)
+        keep = idx < day_sample_num
+        idx = idx[keep]
+        # the samples are sorted by time, so each bin is a contiguous run
+        starts = np.flatnonzero(np.diff(idx, prepend=-1))
+        ends = np.append(starts[1:], len(idx))
+        bin_idx = idx[starts]
+        samples = fileData[keep]
+
+        bins[interval] = {}
+        for agg in aggs:
+            out = np.full((day_sample_num, fileData.shape[1]), np.nan)
+            if not len(starts):
+                bins[interval][agg] = out
+                continue
+            if agg == 'mean':
+                reduced = bin_sum(samples, starts, ends) / \
+                    (ends - starts)[:, None]
+                reduced = np.around(reduced, decimals)
+            elif agg == 'nanmean':
+                counts = np.add.reduceat(~isnan[keep], starts, axis=0)
+                sums = bin_sum(np.where(isnan[keep], 0, samples), starts, ends)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    reduced = np.around(sums / counts, decimals)
+            elif agg == 'min':
+                reduced = np.fmin.reduceat(samples, starts, axis=0)
+            elif agg == 'max':
+                reduced = np.fmax.reduceat(samples, starts, axis=0)
+            else:  # last
+                reduced = samples[ends - 1]
+            out[bin_idx] = reduced
+            out[bin_idx, 0] = bin_idx * interval*60 # fill in the first time stamp
+            bins[interval][agg] = out
+
+    return bins
 
 
 def write_data_csv(file_path, header, data):
     """
     Write the aggregated data of a specific location in a specific year
-    to one csv file
+    to one csv file, or to a columnar .npy/.parquet table if file_path
+    ends with that extension
 
     Args:
         data: the aggregated dictionary
     """
+    from table_io import write_table
     # if file already exists, remove it
     if os.path.exists(file_path):
         os.remove(file_path)
-    with open(file_path, 'w', newline='') as outcsv:
-        writer = csv.writer(outcsv, delimiter=',')
-        writer.writerow(header)
-        for idx in range(data['year'].shape[0]):
-            # reorganize the data from each header into one row
-            row = []
-            for i in range(len(header)):
-                row.append(data[header[i]][idx])
-            #print(row)
-            writer.writerow(row)
+    write_table(file_path, header, data)
+
+
+def stale_locations(y, fmt='csv'):
+    """
+    Get the locations of a year whose table (in format fmt) is missing or
+    older than any of their day csv files
+    """
+    loc_list = []
+    for loc in sorted(os.listdir(y)):
+        loc_path = os.path.join(y, loc)
+        if not os.path.isdir(loc_path):
+            continue
+        file_path = os.path.join(y, '{}.{}'.format(loc, fmt))
+        if not os.path.exists(file_path):
+            loc_list.append(loc)
+            continue
+        mtime = os.path.getmtime(file_path)
+        if any(os.path.getmtime(os.path.join(loc_path, f)) > mtime
+               for f in os.listdir(loc_path)):
+            loc_list.append(loc)
+    return loc_list
 
 
 def daterange(start_date, end_date):
@@ -261,74 +398,279 @@ def daterange(start_date, end_date):
         yield start_date + datetime.timedelta(n)
 
 
+def new_location_data(y, interval):
+    """
+    Init the data of a location in a year: all readings are nans, and the
+    year, month, day and hour of every sample are filled in
+
+    Args:
+        y: the year, str
+        interval: number of minutes per sample
+    Returns:
+        data: dictionary of the readings of each header in all_header
+    """
+    dt_1st_day = datetime.datetime.strptime(y + '0101', '%Y%m%d')
+    dt_last_day = datetime.datetime.strptime(y + '1231', '%Y%m%d')
+    dates = list(daterange(dt_1st_day, dt_last_day+datetime.timedelta(1)))
+    day_sample_num = int(24*60/interval)
+
+    data = {}
+    for h in all_header:
+        # init the readings to nan
+        data[h] = np.empty(len(dates) * day_sample_num)
+        data[h][:] = np.nan
+    data['year'][:] = np.repeat([d.year for d in dates], day_sample_num)
+    data['month'][:] = np.repeat([d.month for d in dates], day_sample_num)
+    data['day'][:] = np.repeat([d.day for d in dates], day_sample_num)
+    data['hour'][:] = np.tile(np.arange(0, 24, interval / 60), len(dates))
+    return data
+
+
+def fill_day(data, delta_days, header, day_data, day_sample_num):
+    """
+    Fill in the averaged data of one day to the data of its location
+
+    Args:
+        data: dictionary of the location, as new_location_data
+        delta_days: number of days from the first day of the year
+        header: header of the day data
+        day_data: dictionary of the averaged day data, as average_day
+        day_sample_num: number of samples per day
+    """
+    # find the start and end index of this new data
+    st_idx = delta_days * day_sample_num
+    ed_idx = (delta_days + 1) * day_sample_num
+    # fill in the new data to corresponding header
+    for h in header:
+        if h != 't':
+            data[h][st_idx:ed_idx] = day_data[h] # join two arrays
+
+
 # In[12]:
 
 
 ###############################
 # Start reorganization
 ###############################
-# basic information during data extraction
-for y in year:
+def reorganize_location(y, loc, interval=60, fmt='csv'):
+    """
+    Average the day csv files of a location in a year and write them to
+    one file
+
+    Args:
+        y: the year to reorganize, str
+        loc: the location to reorganize
+        interval: number of minutes per sample after averaging
+        fmt: format of the location file, csv, npy or parquet
+    Returns:
+        num_files: number of day csv files read
+    """
+    # basic information during data extraction
     dt_1st_day = datetime.datetime.strptime(y + '0101', '%Y%m%d')
     dt_last_day = datetime.datetime.strptime(y + '1231', '%Y%m%d')
     days_in_year = (dt_last_day - dt_1st_day).days + 1 # number of days in year
-    interval = 60 # number of minutes per sample after averaging
     day_sample_num = int(24*60/interval)
     year_sample_num = int(days_in_year*24*60/interval)
+
+    data = new_location_data(y, interval)
+    num_files = 0
+
+    # read the file of each day in an ascending order
+    loc_path = os.path.join(y, loc)
+    for single_date in daterange(dt_1st_day,
+                                 dt_last_day+datetime.timedelta(1)):
+        filename = single_date.strftime("%Y%m%d") + '.csv'
+        file_path = os.path.join(loc_path, filename)
+
+        # do not try reading the file if file does not exist
+        if not os.path.exists(file_path):
+            continue
+
+        # read from the csv file if file exists
+        new_header, new_data = read_file(file_path, interval, day_sample_num)
+        delta_days = (single_date - dt_1st_day).days
+        fill_day(data, delta_days, new_header, new_data, day_sample_num)
+        num_files += 1
+
+    # validation check on length of data
+    for h in data:
+        assert(data[h].shape[0] == year_sample_num), \
+            'Incorrect length for location {} header {}: should be {} ' \
+            'but is {}'.format(loc, h, year_sample_num, data[h].shape[0])
+
+    # write the aggregated data of a location in a year to one file
+    file_path = os.path.join(y, '{}.{}'.format(loc, fmt))
+    write_data_csv(file_path, all_header, data)
+    return num_files
+
+
+def timed_reorganize_location(y, loc, interval, fmt):
+    """reorganize_location, also returning its CPU time in seconds"""
+    st = time.process_time()
+    num_files = reorganize_location(y, loc, interval, fmt)
+    return num_files, time.process_time() - st
+
+
+def reorganize(tasks, interval=60, fmt='csv', processes=1):
+    """
+    Reorganize the given locations, each in its own process if processes > 1
+
+    Every location of every year is written to its own file, so the output
+    does not depend on the number of processes.
+
+    Args:
+        tasks: list of (year, location)
+        interval: number of minutes per sample after averaging
+        fmt: format of the location files, csv, npy or parquet
+        processes: number of worker processes, 1 runs in this process
+    Returns:
+        results: list of (year, location, number of day files, CPU seconds),
+            in the order of tasks
+    """
+    tasks = list(tasks)
+    ys = [y for y, _ in tasks]
+    locs = [loc for _, loc in tasks]
+    st = time.perf_counter()
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            timings = list(pool.map(timed_reorganize_location, ys, locs,
+                                    [interval] * len(tasks),
+                                    [fmt] * len(tasks)))
+    else:
+        timings = [timed_reorganize_location(y, loc, interval, fmt)
+                   for y, loc in tasks]
+    wall = time.perf_counter() - st
+
+    # timing summary: CPU time summed over the tasks against the wall time
+    results = [(y, loc, n, sec) for (y, loc), (n, sec) in zip(tasks, timings)]
+    busy = sum(sec for _, _, _, sec in results)
+    for y in sorted(set(ys)):
+        year_results = [r for r in results if r[0] == y]
+        print('year {}: {} locations, {} day files, {:.2f}s CPU'.format(
+            y, len(year_results), sum(r[2] for r in year_results),
+            sum(r[3] for r in year_results)))
+    if len(results):
+        slowest = max(results, key=lambda r: r[3])
+        print('reorganized {} locations in {:.2f}s with {} processes: '
+              '{:.2f}s CPU, {:.2f}x speedup, slowest {}/{} {:.2f}s'.format(
+              len(results), wall, processes, busy, busy / max(wall, 1e-9),
+              slowest[0], slowest[1], slowest[3]))
+    return results
+
+
+def reorganize_year(y, interval=60, loc_list=None, fmt='csv', processes=1):
+    """
+    Average the day csv files of every location in a year and write one
+    csv file per location
+
+    Args:
+        y: the year to reorganize, str
+        interval: number of minutes per sample after averaging
+        loc_list: locations to reorganize, None means all locations
+        fmt: format of the location files, csv, npy or parquet
+        processes: number of worker processes
+    """
+    day_sample_num = int(24*60/interval)
     print('samples per day: {}'.format(day_sample_num))
-    print('samples per year: {}'.format(year_sample_num))
 
-    # preparation
-    data = {}
-    loc_list = [d for d in os.listdir(y) if os.path.isdir(os.path.join(y, d))]
+    if loc_list is None:
+        loc_list = [d for d in os.listdir(y) if os.path.isdir(os.path.join(y, d))]
     print(loc_list)
+    return reorganize([(y, loc) for loc in sorted(loc_list)], interval, fmt,
+                      processes)
 
-    for loc in loc_list:
-        # add location as the first layer of keys in the data dict
-        data[loc] = {}
-        for h in all_header:
-            # init the readings to nan
-            data[loc][h] = np.empty(year_sample_num)
-            data[loc][h][:] = np.nan
 
-        # read the file of each day in an ascending order
-        loc_path = os.path.join(y, loc)
-        for single_date in daterange(dt_1st_day,
-                                     dt_last_day+datetime.timedelta(1)):
-            filename = single_date.strftime("%Y%m%d") + '.csv'
-            file_path = os.path.join(loc_path, filename)
-            yy, mm, dd = single_date.year, single_date.month, single_date.day
-
-            # find the start and end index of this new data
-            delta_days = (single_date - dt_1st_day).days
-            st_idx = delta_days * day_sample_num
-            ed_idx = (delta_days + 1) * day_sample_num
-            # fill in year, month, day, hour into all slots associated with
-            # this file
-            data[loc]['year'][st_idx:ed_idx] = np.repeat(yy, day_sample_num)
-            data[loc]['month'][st_idx:ed_idx] = np.repeat(mm, day_sample_num)
-            data[loc]['day'][st_idx:ed_idx] = np.repeat(dd, day_sample_num)
-            data[loc]['hour'][st_idx:ed_idx] = np.arange(0, 24, interval / 60)
-
-            # do not try reading the file if file does not exist
-            if not os.path.exists(file_path):
-                continue
+def stream_year(crawler, y, interval=60, raw=False, fmt='csv'):
+    """
+    Query the raw files of a year and average them straight into one csv
+    file per location, keeping the raw day csv files only if raw is True
+
+    Args:
+        crawler: the Crawler used to fetch listings and files
+        y: the year to query, str
+        interval: number of minutes per sample after averaging
+        raw: if True, also write the raw year/loc/day.csv files
+        fmt: format of the location files, csv, npy or parquet
+    """
+    os.makedirs(y, exist_ok=True)
+    data = crawler.stream_year(baseURL, y, filePattern, header, interval, raw)
+    for loc in sorted(data):
+        # write the aggregated data of a location in a year to one file
+        file_path = os.path.join(y, '{}.{}'.format(loc, fmt))
+        write_data_csv(file_path, all_header, data[loc])
 
-            # read from the csv file if file exists
-            new_header, new_data = read_file(file_path, interval, day_sample_num)
-            # pprint(new_data)
 
-            # fill in the new data to corresponding header
-            for h in new_header:
-                if h != 't':
-                    data[loc][h][st_idx:ed_idx] = new_data[h] # join two arrays
+def main():
+    from table_io import table_format
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--year', nargs='+', default=year,
+                        help='years of data to request')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent downloads')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='max requests per second to each host')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='number of retries of a failed request')
+    parser.add_argument('--skip-query', action='store_true',
+                        help='only reorganize the existing day csv files')
+    parser.add_argument('--stream', action='store_true',
+                        help='average the downloaded files on the fly '
+                             'instead of storing one csv file per day')
+    parser.add_argument('--raw', action='store_true',
+                        help='with --stream, still write the day csv files')
+    parser.add_argument('--format', default='csv', type=table_format,
+                        choices=['csv', 'npy', 'parquet'],
+                        help='format of the per-location files')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes reorganizing locations '
+                             'and years in parallel')
+    parser.add_argument('--cache', default=None,
+                        help='directory of the on-disk cache of the HTTP '
+                             'responses, no cache by default')
+    parser.add_argument('--cache-size', type=float, default=2048,
+                        help='max size of the cache in MB')
+    parser.add_argument('--cache-ttl', type=float, default=3600,
+                        help='seconds a cached page that may still change, '
+                             'e.g., the raw file of today, stays valid')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use the cache, never query the site')
+    parser.add_argument('--errors-json', default=None,
+                        help='json file to dump the parse anomalies to')
+    parser.add_argument('--full', action='store_true',
+                        help='remove the year folder and query everything '
+                             'again instead of syncing new or changed files')
+    args = parser.parse_args()
+
+    from crawler import Crawler
+    from http_cache import HTTPCache
+    cache = None
+    if args.cache is not None:
+        cache = HTTPCache(args.cache, max_bytes=int(args.cache_size * 1024**2),
+                          ttl=args.cache_ttl, offline=args.offline)
+    elif args.offline:
+        parser.error('--offline needs a --cache directory')
+    from parse_errors import ParseErrors
+    errors = ParseErrors()
+    crawler = Crawler(workers=args.workers, rate=args.rate,
+                      retries=args.retries, cache=cache, errors=errors)
+    tasks = []
+    for y in args.year:
+        if args.stream:
+            stream_year(crawler, y, raw=args.raw, fmt=args.format)
+            continue
+        if not args.skip_query:
+            query_year(crawler, y, full=args.full)
+        # only the locations with new day files need to be averaged again
+        tasks += [(y, loc) for loc in stale_locations(y, args.format)]
 
-        # validation check on length of data
-        for h in data[loc]:
-            assert(data[loc][h].shape[0] == year_sample_num), \
-                'Incorrect length for location {} header {}: should be {} ' \
-                'but is {}'.format(loc, h, year_sample_num, data[loc][h].shape[0])
+    # one summary of the parse anomalies instead of a print per sample
+    print(errors.report())
+    if args.errors_json is not None:
+        errors.to_json(args.errors_json)
 
-        # write the aggregated data of a location in a year to one csv file
-        file_path = os.path.join(y, '{}.csv'.format(loc))
-        write_data_csv(file_path, all_header, data[loc])
+    # the locations of all years are reorganized together
+    reorganize(tasks, fmt=args.format, processes=args.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,15 @@
 # In[22]:
 
 
-import glob
 import os
-import pandas as pd
-import json
-import copy
 import numpy as np
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import fed_data
+from norm_stats import get_norm_stats
+from table_io import list_tables, load_table
+from windows import WindowedSeries
 
 FEATURES = ['Dn', 'Dm', 'Dx', 'Sn', 'Sm', 'Sx', 'Ta', 'Ua', 'Pa', 'Rc', 'Rd', 'Ri']
 
@@ -19,53 +21,64 @@ def z_norm(x):
     var = np.nanstd(x, axis=0)
     return mean, var
 
-# Compute mean and var
-folder = './2021'
-data = None
-for file_name in glob.glob(os.path.join(folder, '*.csv')):
-    new_df = pd.read_csv(file_name)
-    new_data = np.array(new_df.dropna().values[:, 4:])  # Get rid of data info
-    #print(new_data.shape)
-    if data is None:
-        data = new_data
-    else:
-        data = np.concatenate((data, new_data), axis=0)
-
-print('Shape of all data in {}: {}'.format(folder, data.shape))
-mean, var =  z_norm(data)
-print('Mean: {} Var: {}'.format(mean, var))
-
-
 def sliding_window(data, win_size=24):
-    train_data = []
-    for t in range(win_size, len(data)):
-        train_data.append(data[t-win_size:t])
-    train_data = np.stack(train_data)
-    return train_data
+    # view of the windows data[t-win_size:t], no copy of the data
+    return WindowedSeries(data, win_size).windows
 
 
-def read_data(file_name, win_size=24):
+def read_series(file_name, mean, var):
     # Read raw data and preprocess
-    df = pd.read_csv(file_name)
+    df = load_table(file_name)
     data = np.array(df.dropna().values[:,4:]) # shape = (T,12)
-    data = (data - mean) / var
+    return (data - mean) / var
+
+
+def read_data(file_name, mean, var, win_size=24):
+    data = read_series(file_name, mean, var)
 
     # Insufficient data, return None
     if data.shape[0] <= win_size:
         return None, None
 
-    # Construct training data with sliding window
-    train_data = sliding_window(data, win_size)  # shape = (num_samples, win_size, 12)
-    print(train_data.shape)
+    # Construct training data with sliding window, as views of data
+    train_data = WindowedSeries(data, win_size)  # num_samples windows of (win_size, 12)
+    print(train_data.windows.shape)
 
     # Return training X and y as np array
-    return train_data[:, :-1, :], train_data[:, -1, :]
-
+    return train_data.x, train_data.y
+
+
+def split_folders(out, win_sizes):
+    # Folders of the train and test splits of each window size, out/train and
+    # out/test for a single window size, out/ws<N>/train and out/ws<N>/test
+    # otherwise
+    folders = {}
+    for ws in win_sizes:
+        base = out if len(win_sizes) == 1 else os.path.join(out, 'ws{}'.format(ws))
+        folders[ws] = (os.path.join(base, 'train'), os.path.join(base, 'test'))
+    return folders
+
+
+def write_location(file_name, mean, var, tf, folders):
+    # Read a location once and write its train and test series for every
+    # window size to the binary store, only the number of samples goes back
+    # to the parent process
+    data = read_series(file_name, mean, var)
+    user_name = file_name.split('/')[-1].split('.')[0]
+
+    num_samples = {}
+    for ws, (train_folder, test_folder) in folders.items():
+        if data.shape[0] <= ws:  # Skip the location with invalid data
+            continue
 
-def save_data(data_dict, file_name):
-    # Save the data dictionary with 'users', 'user_data' and 'num_samples' to json file
-    with open(file_name, 'w') as fp:
-        json.dump(data_dict, fp,  indent=4)
+        # The last (1-tf) portion of the windows is for testing. Each split
+        # stores the part of the series its windows are cut from
+        total_len = len(WindowedSeries(data, ws))
+        train_len = total_len - int((1 - tf)*total_len)
+        fed_data.write_user(train_folder, user_name, data[:train_len + ws])
+        fed_data.write_user(test_folder, user_name, data[train_len:])
+        num_samples[ws] = (train_len, total_len - train_len)
+    return user_name, num_samples
 
 
 # In[23]:
@@ -74,56 +87,56 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--tf', type=float, default=0.9,
                         help='fraction of training data, written as a decimal.')
-    parser.add_argument('--ws', type=int, default=24,
-                        help='window size of training data')
+    parser.add_argument('--ws', type=int, nargs='+', default=[24],
+                        help='window size of training data, several sizes are '
+                             'written from one read of the data')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes reading the locations')
+    parser.add_argument('--refresh-stats', action='store_true',
+                        help='compute the mean and var again even if saved')
+    parser.add_argument('--out', type=str, default='.',
+                        help='folder of the train and test splits')
+    parser.add_argument('--json', action='store_true',
+                        help='also write train.json and test.json in the LEAF format')
     args = parser.parse_args()
 
+    # Compute mean and var, or reuse the ones saved next to the data
     folder = './2021'
-    data_dict = {}
-    data_dict['users'] = []
-    data_dict['user_data'] = {}
-    data_dict['num_samples'] = []
-
-    for file_name in glob.glob(os.path.join(folder, '*.csv')):
-        new_X, new_y = read_data(file_name)
-
-        if new_X is None:  # Skip the location with invalid data
-            continue
-        user_name = file_name.split('/')[-1].split('.')[0]
-
-        data_dict['users'].append(user_name)
-        data_dict['user_data'][user_name] = {'x': new_X, 'y': new_y}
-        data_dict['num_samples'].append(new_X.shape[0])
-
-        print('user name: {} num samples: {}'.format(user_name, data_dict['num_samples'][-1]))
-
-
-    train_data_dict = copy.deepcopy(data_dict)
-    test_data_dict = copy.deepcopy(data_dict)
-    for user in data_dict['user_data']:
-        total_len = data_dict['user_data'][user]['x'].shape[0]
-        test_len = int((1 - args.tf)*total_len)
-        train_data_dict['user_data'][user] = \
-            {'x': train_data_dict['user_data'][user]['x'][:-test_len].tolist(),
-            'y': train_data_dict['user_data'][user]['y'][:-test_len].tolist()}
-        test_data_dict['user_data'][user] = \
-            {'x': test_data_dict['user_data'][user]['x'][-test_len:].tolist(),
-            'y': test_data_dict['user_data'][user]['y'][-test_len:].tolist()}
-
-        user_idx = data_dict['users'].index(user)
-        train_data_dict['num_samples'][user_idx] = len(train_data_dict['user_data'][user]['x'])
-        test_data_dict['num_samples'][user_idx] = len(test_data_dict['user_data'][user]['x'])
-
-    print('train users are: ', train_data_dict['user_data'].keys())
-    print('train num_samples are: ', train_data_dict['num_samples'])
-
-    print('test users are: ', test_data_dict['user_data'].keys())
-    print('test num_samples are: ', test_data_dict['num_samples'])
-
-    # Save data to json
-    save_data(train_data_dict, 'train.json')
-    save_data(test_data_dict, 'test.json')
-    print('Data saved to json')
+    mean, var = get_norm_stats(folder, processes=args.processes,
+                               refresh=args.refresh_stats)
+    print('Mean: {} Var: {}'.format(mean, var))
+
+    # Each location is read, normalized and written by one process
+    files = list_tables(folder)
+    folders = split_folders(args.out, args.ws)
+    tasks = [(f, mean, var, args.tf, folders) for f in files]
+    if args.processes > 1:
+        with ProcessPoolExecutor(args.processes) as pool:
+            results = list(pool.map(write_location, *zip(*tasks)))
+    else:
+        results = [write_location(*task) for task in tasks]
+
+    for ws, (train_folder, test_folder) in folders.items():
+        users = [user for user, num_samples in results if ws in num_samples]
+        train_num_samples = [num_samples[ws][0] for _, num_samples in results
+                             if ws in num_samples]
+        test_num_samples = [num_samples[ws][1] for _, num_samples in results
+                            if ws in num_samples]
+        fed_data.write_index(train_folder, users, train_num_samples, ws)
+        fed_data.write_index(test_folder, users, test_num_samples, ws)
+
+        print('window size: {}'.format(ws))
+        print('train users are: ', users)
+        print('train num_samples are: ', train_num_samples)
+
+        print('test users are: ', users)
+        print('test num_samples are: ', test_num_samples)
+        print('Data saved to {} and {}'.format(train_folder, test_folder))
+
+        if args.json:
+            fed_data.to_leaf_json(train_folder, train_folder + '.json')
+            fed_data.to_leaf_json(test_folder, test_folder + '.json')
+            print('Data saved to json')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streaming inference of the recurrent models (RNN, LSTM, GRU) in models.py.
+# The hidden state of every station is kept between observations, so a new
+# observation costs one step of the model instead of a rerun of the window.
+
+import argparse
+import time
+
+import torch
+
+from models import LSTM, build_model
+
+
+class StreamingForecaster:
+    """
+    Forecast the next observation of many stations, one step per observation
+
+    The forecast of a station is the output of the model on every observation
+    since the station was added or reset, which is the output of the model on
+    the window of those observations. A model trained on windows of win_size-1
+    steps is best used by resetting or priming a station on its last window
+    before its state has seen much more than win_size-1 steps.
+
+    Args:
+        model: a RNN, LSTM or GRU of models.py
+        capacity: number of stations allocated at first, doubled when needed
+    """
+
+    def __init__(self, model, capacity=64):
+        self.model = model.eval()
+        self.slots = {}  # station -> index of its state
+        self.steps = torch.zeros(0, dtype=torch.long)  # steps since reset
+        self.state = None
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        # states of (num_layers, capacity, hidden_size), (h, c) for a LSTM,
+        # as normal tensors even when step grows them under inference mode,
+        # so that reset and prime can still write them
+        param = next(self.model.parameters())
+        shape = (self.model.num_layers, capacity, self.model.hidden_size)
+        num = 2 if isinstance(self.model, LSTM) else 1
+        with torch.inference_mode(False):
+            state = tuple(torch.zeros(shape, dtype=param.dtype,
+                                      device=param.device)
+                          for _ in range(num))
+            steps = torch.zeros(capacity, dtype=torch.long)
+            if self.state is not None:
+                used = self.state[0].shape[1]
+                for new, old in zip(state, self.state):
+                    new[:, :used] = old
+                steps[:used] = self.steps
+        self.state, self.steps = state, steps
+
+    def _slots(self, stations):
+        for station in stations:
+            if station not in self.slots:
+                if len(self.slots) == self.state[0].shape[1]:
+                    self._allocate(2 * len(self.slots))
+                self.slots[station] = len(self.slots)
+        return torch.tensor([self.slots[s] for s in stations],
+                            device=self.state[0].device)
+
+    def reset(self, stations):
+        """Forget the history of stations"""
+        slots = self._slots(stations)
+        for t in self.state:
+            t[:, slots] = 0
+        self.steps[slots.cpu()] = 0
+
+    @torch.inference_mode()
+    def step(self, stations, x):
+        """
+        Advance stations by one observation each
+
+        Args:
+            stations: list of station names, each at most once
+            x: tensor of (len(stations), input_size), the new observations
+        Returns:
+            pred: tensor of (len(stations), output_size), the forecast of the
+                next observation of each station
+        """
+        slots = self._slots(stations)
+        state = tuple(t[:, slots] for t in self.state)
+        pred, state = self.model.step(x, state if len(state) > 1 else state[0])
+        if not isinstance(state, tuple):
+            state = (state,)
+        for t, new in zip(self.state, state):
+            t[:, slots] = new
+        self.steps[slots.cpu()] += 1
+        return pred
+
+    def prime(self, stations, windows):
+        """
+        Reset stations and feed them a window of observations each
+
+        Args:
+            stations: list of station names, each at most once
+            windows: tensor of (len(stations), T, input_size)
+        Returns:
+            pred: the forecasts after the last observation of the windows
+        """
+        self.reset(stations)
+        pred = None
+        for t in range(windows.shape[1]):
+            pred = self.step(stations, windows[:, t])
+        return pred
+
+
+def check_streaming(model, windows):
+    """
+    Compare the forecasts of the streaming steps with the forward pass of the
+    model on the full windows
+
+    The forecaster starts with room for one station, so the first step grows
+    its state, and a station is then reset and primed again on its window.
+
+    Args:
+        model: a RNN, LSTM or GRU of models.py
+        windows: tensor of (num_stations, T, input_size), one station each
+    Returns:
+        max_err: the largest absolute difference of the forecasts
+    """
+    forecaster = StreamingForecaster(model, capacity=1)
+    stations = list(range(windows.shape[0]))
+    for t in range(windows.shape[1]):
+        pred = forecaster.step(stations, windows[:, t])
+    with torch.inference_mode():
+        full = model(windows)
+    err = (pred - full).abs().max().item()
+
+    forecaster.reset(stations[:1])
+    pred = forecaster.prime(stations[:1], windows[:1])
+    return max(err, (pred - full[:1]).abs().max().item())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='check the streaming forecasts against the full windows '
+                    'and time one step against one window')
+    parser.add_argument('--model', type=str, default='lstm',
+                        choices=['rnn', 'lstm', 'gru'], help='the model')
+    parser.add_argument('--state-dict', type=str, default=None,
+                        help='weights of the model, e.g., global written by '
+                             'test_lstm.py; random weights if not given')
+    parser.add_argument('--hidden-size', type=int, default=128,
+                        help='hidden size of the model')
+    parser.add_argument('--num-layers', type=int, default=1,
+                        help='number of layers of the model')
+    parser.add_argument('--stations', type=int, default=64,
+                        help='number of stations forecast together')
+    parser.add_argument('--ws', type=int, default=24,
+                        help='window size, the model sees ws-1 observations')
+    args = parser.parse_args()
+
+    input_size = output_size = 12
+    model = build_model(args.model, input_size, args.hidden_size, output_size,
+                        args.num_layers)
+    if args.state_dict is not None:
+        model.load_state_dict(torch.load(args.state_dict, map_location='cpu'))
+    model.eval()
+
+    windows = torch.randn(args.stations, args.ws - 1, input_size)
+    print('max abs error of the streaming forecasts: {:.2e}'.format(
+        check_streaming(model, windows)))
+
+    forecaster = StreamingForecaster(model, capacity=args.stations)
+    stations = list(range(args.stations))
+    forecaster.prime(stations, windows)
+    x = torch.randn(args.stations, input_size)
+    repeat = 100
+    st = time.perf_counter()
+    for _ in range(repeat):
+        forecaster.step(stations, x)
+    step_time = (time.perf_counter() - st) / repeat
+    with torch.inference_mode():
+        st = time.perf_counter()
+        for _ in range(repeat):
+            model(windows)
+        window_time = (time.perf_counter() - st) / repeat
+    print('{} stations: {:.3f} ms per step, {:.3f} ms per window'.format(
+        args.stations, 1000 * step_time, 1000 * window_time))
+
+
+if __name__ == "__main__":
+    main()
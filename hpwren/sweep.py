@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Hyperparameter sweep over the models of models.py with train.py. The series
+# of the table is loaded once into shared memory, and every trial cuts its
+# windows as views of it, whatever its window size. Trials run in a process
+# pool and are pruned by successive halving: all trials train for a few
+# epochs, the best 1/eta go on for eta times more epochs, and so on.
+#
+# The search space is a json file of one list of values per setting, e.g.,
+#   {"model": ["lstm", "gru"], "hidden_size": [32, 64, 128],
+#    "lr": {"log_uniform": [0.0001, 0.01]}}
+# searched as a grid, or by --random N trials, which also accept
+# {"uniform": [low, high]}, {"log_uniform": [low, high]} and
+# {"int": [low, high]} distributions.
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from train import DEFAULTS, Checkpointer, load_series, make_splits, train
+
+# series of the table shared by the processes of the pool
+_shared = {}
+
+
+def grid_trials(space):
+    """Every combination of the values of the space"""
+    for key, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError('A grid needs a list of values for {}'.format(key))
+    keys = list(space)
+    return [dict(zip(keys, values))
+            for values in itertools.product(*(space[k] for k in keys))]
+
+
+def sample(values, rng):
+    """Draw a value of a setting of the space"""
+    if isinstance(values, list):
+        return values[rng.integers(len(values))]
+    (kind, (low, high)), = values.items()
+    if kind == 'uniform':
+        return float(rng.uniform(low, high))
+    if kind == 'log_uniform':
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+    if kind == 'int':
+        return int(rng.integers(low, high + 1))
+    raise ValueError('Unknown distribution {}'.format(kind))
+
+
+def random_trials(space, num_trials, seed=0):
+    """num_trials settings drawn at random from the space"""
+    rng = np.random.default_rng(seed)
+    return [{k: sample(v, rng) for k, v in space.items()}
+            for _ in range(num_trials)]
+
+
+def trial_folder(out, i, config):
+    """Folder of trial i, named by a hash of its config as well, so that a
+    trial of another sweep in out never shares its checkpoints"""
+    key = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    return os.path.join(out, 'trial{:03d}-{}'.format(i, key.hexdigest()[:10]))
+
+
+def _init_worker(name, shape, dtype, threads):
+    # attach the shared series, the parent process owns and unlinks it
+    shm = shared_memory.SharedMemory(name=name)
+    _shared['shm'] = shm
+    _shared['series'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    torch.set_num_threads(threads)
+
+
+def run_trial(config, folder, epochs):
+    """
+    Train a trial up to epochs, continuing from its previous rung if any
+
+    Returns:
+        result: the result of train.train, with the trial folder
+    """
+    series = _shared['series']
+    splits = make_splits(series, config['win_size'], config['val_frac'],
+                         config['test_frac'])
+    checkpointer = Checkpointer(folder)
+    try:
+        result = train(dict(config, epochs=epochs), splits, checkpointer,
+                       resume=True, verbose=False)
+    finally:
+        checkpointer.close()
+    result['folder'] = folder
+    return result
+
+
+def successive_halving(configs, out, pool, min_epochs, max_epochs, eta=3):
+    """
+    Train the trials by rungs of growing budgets, keeping the best 1/eta of the
+    trials by validation MSE at every rung
+
+    A trial resumes from its checkpoint of the previous rung of this run only,
+    the checkpoints left in its folder by an earlier run are removed first.
+
+    Returns:
+        results: for every trial, the result of its last rung and the rung
+    """
+    folders = [trial_folder(out, i, config) for i, config in enumerate(configs)]
+    for folder in folders:
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+    results = [None] * len(configs)
+    alive = list(range(len(configs)))
+    epochs, rung = min_epochs, 0
+    while True:
+        st = time.time()
+        for i, result in zip(alive, pool.map(run_trial,
+                                             [configs[i] for i in alive],
+                                             [folders[i] for i in alive],
+                                             [epochs] * len(alive))):
+            results[i] = dict(result, rung=rung)
+        print('rung {}: {} trials trained up to {} epochs in {:.1f}s'.format(
+            rung, len(alive), epochs, time.time() - st))
+        if epochs >= max_epochs or len(alive) <= 1:
+            return results
+        alive.sort(key=lambda i: results[i]['val_mse'])
+        alive = alive[:max(len(alive) // eta, 1)]
+        epochs, rung = min(epochs * eta, max_epochs), rung + 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('space', help='json file of the search space')
+    parser.add_argument('--random', type=int, default=0,
+                        help='number of random trials, 0 searches the grid')
+    parser.add_argument('--config', type=str, default=None,
+                        help='json file of the settings shared by all trials')
+    parser.add_argument('--table', type=str, default=DEFAULTS['table'],
+                        help='table to train on')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='number of processes running trials')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of torch threads of each process')
+    parser.add_argument('--min-epochs', type=int, default=3,
+                        help='epochs of every trial in the first rung')
+    parser.add_argument('--max-epochs', type=int, default=81,
+                        help='epochs of the trials of the last rung')
+    parser.add_argument('--eta', type=int, default=3,
+                        help='1/eta of the trials go on to the next rung, with '
+                             'eta times more epochs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random search')
+    parser.add_argument('--out', type=str, default='sweep',
+                        help='folder of the trials and the results table')
+    args = parser.parse_args()
+
+    with open(args.space, 'r') as fp:
+        space = json.load(fp)
+    if 'table' in space:
+        parser.error('all trials share the series of --table')
+    base = dict(DEFAULTS, table=args.table)
+    if args.config is not None:
+        with open(args.config, 'r') as fp:
+            base.update(json.load(fp))
+    trials = random_trials(space, args.random, args.seed) if args.random \
+        else grid_trials(space)
+    configs = [dict(base, **trial) for trial in trials]
+    print('{} trials on {} processes'.format(len(configs), args.workers))
+
+    os.makedirs(args.out, exist_ok=True)
+    series = load_series(base['table'])
+    shm = shared_memory.SharedMemory(create=True, size=series.nbytes)
+    try:
+        np.ndarray(series.shape, series.dtype, buffer=shm.buf)[:] = series
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                 initargs=(shm.name, series.shape,
+                                           series.dtype, args.threads)) as pool:
+            results = successive_halving(configs, args.out, pool,
+                                         args.min_epochs, args.max_epochs,
+                                         args.eta)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    keys = list(space)
+    rows = sorted(({**{k: trial[k] for k in keys}, **result}
+                   for trial, result in zip(trials, results)),
+                  key=lambda r: (-r['rung'], r['val_mse']))
+    columns = keys + ['rung', 'epochs_run', 'best_epoch', 'val_mse',
+                      'test_mse', 'train_time', 'folder']
+    with open(os.path.join(args.out, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(args.out, 'results.json'), 'w') as fp:
+        json.dump({'space': space, 'base': base, 'results': rows}, fp,
+                  indent=4)
+
+    print(''.join('{:>14}'.format(c) for c in columns[:-1]))
+    for row in rows:
+        print(''.join('{:>14.5f}'.format(row[c]) if isinstance(row[c], float)
+                      else '{:>14}'.format(str(row[c])) for c in columns[:-1]))
+    print('Results saved to {}'.format(os.path.join(args.out, 'results.csv')))
+
+
+if __name__ == "__main__":
+    main()
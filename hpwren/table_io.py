@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Read and write the per-location yearly tables produced by query_data.py.
+# Besides csv, a table can be stored as one .npy array with a .json schema,
+# which is memory-mapped on load, or as Parquet if pyarrow is installed.
+
+import argparse
+import csv
+import glob
+import json
+import os
+
+import numpy as np
+
+# formats in the order they are preferred when loading a table
+FORMATS = ['npy', 'parquet', 'csv']
+
+
+def table_format(fmt):
+    """
+    Argument type of a table format, which fails while the arguments are
+    parsed, not after the download, if fmt is parquet and pandas has no
+    Parquet engine (pyarrow or fastparquet) to write it with
+    """
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            try:
+                import fastparquet  # noqa: F401
+            except ImportError:
+                raise argparse.ArgumentTypeError(
+                    'the parquet format needs pyarrow, e.g., '
+                    'pip3 install pyarrow')
+    return fmt
+
+
+def write_table(file_path, header, data):
+    """
+    Write the data of a location to file_path, in the format given by its
+    extension
+
+    Args:
+        file_path: path of the table, ending with .csv, .npy or .parquet
+        header: the columns to write, in order
+        data: dictionary of one array per column
+    """
+    ext = os.path.splitext(file_path)[1]
+    table = np.column_stack([np.asarray(data[h], dtype=float) for h in header])
+    if ext == '.csv':
+        with open(file_path, 'w', newline='') as outcsv:
+            writer = csv.writer(outcsv, delimiter=',')
+            writer.writerow(header)
+            writer.writerows(table.tolist())
+    elif ext == '.npy':
+        # store columns contiguously, so a memory-mapped column is one read
+        np.save(file_path, np.asfortranarray(table))
+        schema = {'columns': list(header), 'dtype': str(table.dtype),
+                  'rows': table.shape[0]}
+        with open(schema_path(file_path), 'w') as fp:
+            json.dump(schema, fp, indent=4)
+    elif ext == '.parquet':
+        import pandas as pd
+        pd.DataFrame(table, columns=header).to_parquet(file_path, index=False)
+    else:
+        raise ValueError('Unknown table format {}'.format(file_path))
+
+
+def schema_path(file_path):
+    """Path of the json schema of a .npy table"""
+    return os.path.splitext(file_path)[0] + '.json'
+
+
+def find_table(path):
+    """
+    Resolve a table path, where a path without extension, e.g., 2021/MG,
+    picks the first existing format in FORMATS
+    """
+    if os.path.splitext(path)[1] in ['.' + fmt for fmt in FORMATS]:
+        return path
+    for fmt in FORMATS:
+        if os.path.exists('{}.{}'.format(path, fmt)):
+            return '{}.{}'.format(path, fmt)
+    raise FileNotFoundError('No table found for {}'.format(path))
+
+
+def list_tables(folder):
+    """
+    List the tables of a folder, one per location, preferring the formats
+    that load without text parsing
+    """
+    tables = {}
+    for fmt in reversed(FORMATS):
+        for file_path in glob.glob(os.path.join(folder, '*.' + fmt)):
+            if fmt == 'npy' and not os.path.exists(schema_path(file_path)):
+                continue
+            tables[os.path.splitext(file_path)[0]] = file_path
+    return [tables[name] for name in sorted(tables)]
+
+
+def load_table(path, mmap=True):
+    """
+    Load a table as a pandas DataFrame
+
+    Args:
+        path: path of the table, with or without extension (see find_table)
+        mmap: if True, .npy tables are memory-mapped instead of read
+    Returns:
+        df: DataFrame with one column per header
+    """
+    import pandas as pd
+    file_path = find_table(path)
+    ext = os.path.splitext(file_path)[1]
+    if ext == '.npy':
+        with open(schema_path(file_path), 'r') as fp:
+            schema = json.load(fp)
+        table = np.load(file_path, mmap_mode='r' if mmap else None)
+        return pd.DataFrame(table, columns=schema['columns'], copy=False)
+    if ext == '.parquet':
+        return pd.read_parquet(file_path)
+    return pd.read_csv(file_path)
+
+
+def iter_chunks(path, chunk_rows=100000):
+    """
+    Iterate over a table in DataFrames of at most chunk_rows rows, without
+    holding the whole table in memory
+
+    Args:
+        path: path of the table, with or without extension (see find_table)
+        chunk_rows: number of rows per chunk
+    """
+    import pandas as pd
+    file_path = find_table(path)
+    ext = os.path.splitext(file_path)[1]
+    if ext == '.csv':
+        yield from pd.read_csv(file_path, chunksize=chunk_rows)
+        return
+    df = load_table(file_path)  # memory-mapped or columnar
+    for st in range(0, len(df), chunk_rows):
+        yield df.iloc[st:st + chunk_rows]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Tests of crawler.py against a local http.server copy of the HPWREN tree made
+# by benchmark.make_site, run with `python -m unittest test_crawler` in hpwren/.
+
+import functools
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager, redirect_stdout
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from benchmark import ListingHandler, make_site, serve
+from crawler import Crawler, RateLimiter
+from manifest import Manifest
+from query_data import filePattern, header, parse_page
+
+YEAR = '2021'
+
+
+class FlakyHandler(ListingHandler):
+    """Answer the first `failures` requests of every path with the given
+    status codes, in turn, and record the time of every request"""
+
+    failures = (429, 503)
+    lock = threading.Lock()
+    counts = {}
+    times = []
+
+    def do_GET(self):
+        with self.lock:
+            self.times.append(time.monotonic())
+            n = self.counts.get(self.path, 0)
+            self.counts[self.path] = n + 1
+        if n < len(self.failures):
+            self.send_response(self.failures[n])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        super().do_GET()
+
+
+class ValidatorHandler(ListingHandler):
+    """Serve files with or without Content-Length and Last-Modified headers"""
+
+    validators = True
+
+    def send_header(self, keyword, value):
+        if self.validators or \
+                keyword not in ('Content-Length', 'Last-Modified'):
+            super().send_header(keyword, value)
+
+
+@contextmanager
+def serve_handler(root, handler):
+    """Serve root with a handler class on a local port, yielding the base url"""
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(handler, directory=root))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def serve_flaky(root, failures):
+    handler = type('Handler', (FlakyHandler,),
+                   {'failures': failures, 'counts': {}, 'times': []})
+    with serve_handler(root, handler) as base_url:
+        yield base_url, handler
+
+
+class CrawlerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.site = os.path.join(cls.tmp.name, 'site')
+        make_site(cls.site, YEAR, stations=3, days=2, sample_period=600,
+                  missing_rate=0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        # crawl_year writes year/loc/day.csv under the working directory
+        self.cwd = os.getcwd()
+        self.out = tempfile.mkdtemp(dir=self.tmp.name)
+        os.chdir(self.out)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def raw_files(self):
+        """Path of the raw file of every (location, day) of the site"""
+        files = {}
+        for d in sorted(os.listdir(os.path.join(self.site, YEAR))):
+            for f in os.listdir(os.path.join(self.site, YEAR, d)):
+                loc = f.split(':')[1].split('-')[0]
+                files[(loc, d)] = os.path.join(self.site, YEAR, d, f)
+        return files
+
+    def test_crawl_year_layout(self):
+        with serve(self.site) as base_url, redirect_stdout(io.StringIO()):
+            written = Crawler(workers=4, rate=0).crawl_year(
+                base_url, YEAR, filePattern, header)
+
+        raw_files = self.raw_files()
+        expected = sorted(os.path.join(YEAR, loc, '{}.csv'.format(d))
+                          for loc, d in raw_files)
+        self.assertEqual(sorted(written), expected)
+        for (loc, d), raw_file in raw_files.items():
+            file_path = os.path.join(YEAR, loc, '{}.csv'.format(d))
+            with open(file_path, 'r') as f:
+                self.assertEqual(f.readline().strip().split(','), header)
+            with open(raw_file, 'r') as f:
+                parsed = parse_page(f.read(), header)
+            data = np.genfromtxt(file_path, delimiter=',', skip_header=1)
+            np.testing.assert_array_equal(data, parsed)
+
+    def test_manifest_sync(self):
+        site = os.path.join(self.out, 'site')
+        make_site(site, YEAR, stations=2, days=1, sample_period=600)
+        os.makedirs(YEAR)
+        manifest = Manifest(os.path.join(YEAR, 'manifest.jsonl'))
+        crawler = Crawler(workers=2, rate=0)
+        handler = type('Handler', (ValidatorHandler,), {})
+
+        def crawl():
+            return crawler.crawl_year(base_url, YEAR, filePattern, header,
+                                      manifest)
+
+        with serve_handler(site, handler) as base_url, \
+                redirect_stdout(io.StringIO()):
+            written = crawl()
+            self.assertEqual(len(written), 2)
+            file_path = written[0]
+
+            # recorded before its day settled and unchanged since, the file is
+            # not fetched again but becomes complete
+            manifest.update(file_path, dict(manifest.get(file_path),
+                                            complete=False))
+            self.assertEqual(crawl(), [])
+            self.assertTrue(manifest.get(file_path)['complete'])
+
+            # without size and date headers, the file is fetched again and
+            # only written if its content changed
+            handler.validators = False
+            manifest.update(file_path, dict(manifest.get(file_path),
+                                            complete=False, size=None,
+                                            last_modified=None))
+            self.assertEqual(crawl(), [])
+            self.assertTrue(manifest.get(file_path)['complete'])
+
+            manifest.update(file_path, dict(manifest.get(file_path),
+                                            complete=False))
+            raw_file = os.path.join(
+                site, manifest.get(file_path)['url'][len(base_url):])
+            with open(raw_file, 'r') as f:
+                lines = f.read().splitlines(keepends=True)
+            with open(raw_file, 'w') as f:
+                f.writelines(lines[:-1])
+            self.assertEqual(crawl(), [file_path])
+
+        with open(raw_file, 'r') as f:
+            parsed = parse_page(f.read(), header)
+        np.testing.assert_array_equal(
+            np.genfromtxt(file_path, delimiter=',', skip_header=1), parsed)
+
+    def test_retry_then_succeed(self):
+        loc, d = sorted(self.raw_files())[0]
+        raw_file = self.raw_files()[(loc, d)]
+        url_path = os.path.relpath(raw_file, self.site)
+        with open(raw_file, 'rb') as f:
+            content = f.read()
+
+        with serve_flaky(self.site, (429, 500, 503)) as (base_url, handler):
+            crawler = Crawler(workers=1, rate=0, retries=3, backoff=0.01)
+            response = crawler.get(base_url + url_path)
+            self.assertEqual(response.content, content)
+            self.assertEqual(len(handler.times), 4)
+
+        with serve_flaky(self.site, (502, 504)) as (base_url, handler):
+            crawler = Crawler(workers=1, rate=0, retries=1, backoff=0.01)
+            with self.assertRaises(requests.HTTPError):
+                crawler.get(base_url + url_path)
+            self.assertEqual(len(handler.times), 2)
+
+    def test_rate_limiter(self):
+        rate = 20.0
+        limiter = RateLimiter(rate)
+        times = []
+        for _ in range(6):
+            limiter.acquire()
+            times.append(time.monotonic())
+        # the first request passes at once, the next ones every 1/rate s
+        self.assertGreaterEqual(times[-1] - times[0], 5 / rate * 0.9)
+        self.assertTrue(np.all(np.diff(times) >= 1 / rate * 0.9))
+
+        # requests of several workers to a host are spaced the same way
+        with serve_flaky(self.site, ()) as (base_url, handler):
+            crawler = Crawler(workers=4, rate=rate)
+            threads = [threading.Thread(target=crawler.get, args=(base_url,))
+                       for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            times = sorted(handler.times)
+        self.assertEqual(len(times), 6)
+        self.assertGreaterEqual(times[-1] - times[0], 5 / rate * 0.8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,20 @@
 # Code contributed by Xiyuan Zhang (https://xiyuanzh.github.io/) in 04/2022
 
-import pandas as pd
+import time
 import numpy as np
 import torch
-from models import RNN, LSTM, GRU, CNN, MLP
+from batch_loader import BatchLoader
+from models import build_model
+from table_io import load_table
+from windows import WindowedSeries
 #from transformer import Transformer
 
 ##### helper function #####
-def DataBatch(data, batchsize, shuffle=True):
-
-    n = data.shape[0]
-    if shuffle:
-        index = np.random.permutation(n)
-    else:
-        index = np.arange(n)
-    for i in range(int(np.ceil(n/batchsize))):
-        inds = index[i*batchsize : min(n,(i+1)*batchsize)]
-        yield inds, data[inds]
-
 def sliding_window(data, win_size=48):
 
-    train_data = []
-    for t in range(win_size, len(data)):
-        train_data.append(data[t-win_size:t])
-    train_data = np.stack(train_data)
-    train_data = torch.from_numpy(train_data).float()
-    return train_data
+    # tensor view of the windows, a batch is only copied when indexed
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    return WindowedSeries(data, win_size).tensor()
 
 def z_norm(x):
 
@@ -47,7 +36,7 @@ num_layers = 1
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 ##### data preparation #####
-df = pd.read_csv('2021/MG.csv')
+df = load_table('2021/MG') # MG.npy, MG.parquet or MG.csv
 df = df.dropna()
 data = df.values[:,4:] # shape = (T,12)
 mean, var =  z_norm(data)
@@ -60,12 +49,14 @@ test_data = data[-test_samples_num:]
 train_data = sliding_window(train_data, win_size) # N_train, win_size, 12
 test_data = sliding_window(test_data, win_size) # N_test, win_size, 12
 
+# batches are gathered by background threads while the model computes
+train_loader = BatchLoader(train_data, batch_size, shuffle=True, device=device)
+test_loader = BatchLoader(test_data, batch_size, shuffle=False, device=device)
+
 ########## model ##########
-#model = RNN(input_size, hidden_size, output_size, num_layers).to(device)
-model = LSTM(input_size, hidden_size, output_size, num_layers, device).to(device)
-#model = GRU(input_size, hidden_size, output_size, num_layers).to(device)
-#model = CNN(input_size, hidden_size, output_size, win_size-1).to(device)
-#model = MLP(input_size, hidden_size, output_size, win_size-1).to(device)
+model_name = 'lstm' # one of models.MODELS: rnn, lstm, gru, cnn or mlp
+model = build_model(model_name, input_size, hidden_size, output_size,
+                    num_layers, win_size-1, device)
 
 criterion = torch.nn.MSELoss()    # mean-squared error for regression
 optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
@@ -74,10 +65,9 @@ optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
 ##### Train the model #####
 for epoch in range(num_epochs):
 
+    st = time.time()
     total_loss = 0
-    for inds, batch_data in DataBatch(train_data, batch_size):
-
-        batch_data = batch_data.to(device)
+    for batch_data in train_loader:
 
         optimizer.zero_grad()
 
@@ -86,24 +76,30 @@ for epoch in range(num_epochs):
 
         pred = model(input)
         loss = criterion(gt, pred)
-        total_loss += loss * len(batch_data)
+        total_loss += loss.detach() * len(batch_data)
 
         loss.backward()
         optimizer.step()
 
     print("Epoch: %d, loss: %1.5f" % (epoch, total_loss.item() / len(train_data)))
+    train_time = time.time() - st
 
+    st = time.time()
     err = 0
-    for inds, batch_data in DataBatch(test_data, batch_size):
+    with torch.inference_mode():  # no autograd for testing
+        for batch_data in test_loader:
 
-        batch_data = batch_data.to(device)
+            input = batch_data[:,:-1,:]
+            gt = batch_data[:,-1,:]
 
-        input = batch_data[:,:-1,:]
-        gt = batch_data[:,-1,:]
-
-        pred = model(input)
-        err += len(batch_data) * criterion(gt, pred)
+            pred = model(input)
+            err += len(batch_data) * criterion(gt, pred)
 
     print("Epoch: %d, MSE: %1.5f" % (epoch, err.item() / len(test_data)))
+    test_time = time.time() - st
+
+    data_wait = train_loader.wait + test_loader.wait
+    print("Epoch: %d, data wait: %.2fs, compute: %.2fs" %
+          (epoch, data_wait, train_time + test_time - data_wait))
 
     torch.save(model.state_dict(), 'global')
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Training driver for the models of models.py on a HPWREN table, as in
+# test_lstm.py but configurable: early stopping on the validation MSE,
+# checkpoints written by a background thread, and resume of an interrupted run.
+#
+#   python train.py --model gru --hidden-size 64 --out runs/gru64
+#   python train.py --config runs/gru64/config.json --resume
+
+import argparse
+import copy
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from batch_loader import BatchLoader
+from models import MODELS, build_model
+from table_io import load_table
+from windows import WindowedSeries
+
+DEFAULTS = {
+    'table': '2021/MG',
+    'model': 'lstm',
+    'hidden_size': 128,
+    'num_layers': 1,
+    'win_size': 24,
+    'batch_size': 32,
+    'lr': 0.001,
+    'epochs': 200,
+    'patience': 10,
+    'min_delta': 0.0,
+    'val_frac': 0.04,
+    'test_frac': 0.04,
+    'seed': 0,
+    'threads': 0,
+}
+
+
+def load_series(table, dtype=np.float32):
+    """
+    Complete samples of a table, normalized as in test_lstm.py
+
+    This and split_points are the split of test_lstm.py shared by train.py,
+    sweep.py, export.py, bench_models.py and baselines.py, so all of them
+    score on the same test windows.
+
+    Returns:
+        data: array of (T, 12) of dtype
+    """
+    data = load_table(table).dropna().values[:, 4:]
+    data = (data - np.nanmean(data, axis=0)) / np.nanstd(data, axis=0)
+    return np.ascontiguousarray(data, dtype=dtype)
+
+
+def split_points(num_samples, val_frac=0.04, test_frac=0.04):
+    """
+    Where a series of num_samples is split: the test part is the last
+    test_frac of the series, as in test_lstm.py, and the validation part the
+    val_frac before it
+
+    Returns:
+        val_start, test_start: indices of the first validation and test
+            samples
+    """
+    num_test = int(test_frac * num_samples)
+    num_val = int(val_frac * num_samples)
+    return num_samples - num_val - num_test, num_samples - num_test
+
+
+def make_splits(data, win_size, val_frac=0.04, test_frac=0.04):
+    """
+    Split a series in train, validation and test windows, see split_points
+
+    Returns:
+        train, val, test: tensors of windows, (num_windows, win_size, 12)
+    """
+    val_start, test_start = split_points(data.shape[0], val_frac, test_frac)
+    return (WindowedSeries(data[:val_start], win_size).tensor(),
+            WindowedSeries(data[val_start:test_start], win_size).tensor(),
+            WindowedSeries(data[test_start:], win_size).tensor())
+
+
+def evaluate(model, loader):
+    """MSE of the model on the windows of a BatchLoader, without autograd"""
+    model.eval()
+    err = 0.0
+    with torch.inference_mode():
+        for batch in loader:
+            pred = model(batch[:, :-1])
+            err += torch.sum((pred - batch[:, -1]) ** 2).item()
+    windows = loader.windows
+    return err / max(windows.shape[0] * windows.shape[2], 1)
+
+
+class Checkpointer:
+    """
+    Write checkpoints from a background thread, the training only waits for a
+    copy of the state
+
+    Args:
+        folder: folder of last.pt, the state to resume from, and best.pt, the
+            weights of the model with the lowest validation MSE
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.pool = ThreadPoolExecutor(1)
+        self.pending = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _write(self, obj, name):
+        path = os.path.join(self.folder, name)
+        torch.save(obj, path + '.part')
+        os.replace(path + '.part', path)
+
+    def _write_all(self, state, best):
+        self._write(state, 'last.pt')
+        if best:
+            self._write(state['model'], 'best.pt')
+
+    def save(self, state, best=False):
+        """Save a training state, and the model as the best one if best"""
+        state = copy.deepcopy(state)  # the training goes on meanwhile
+        self.wait()
+        self.pending = self.pool.submit(self._write_all, state, best)
+
+    def wait(self):
+        """Block until the last checkpoint is written"""
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def load(self):
+        """The last training state, or None"""
+        path = os.path.join(self.folder, 'last.pt')
+        if not os.path.exists(path):
+            return None
+        return torch.load(path, map_location='cpu', weights_only=False)
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+
+def train(config, splits=None, checkpointer=None, resume=False, verbose=True):
+    """
+    Train a model with early stopping on the validation MSE
+
+    Args:
+        config: dictionary of the settings, see DEFAULTS
+        splits: train, val and test windows, made from config['table'] if None
+        checkpointer: Checkpointer of the run, None for no checkpoints
+        resume: if True, continue from the last checkpoint if any
+        verbose: if True, print the loss and MSE of every epoch
+    Returns:
+        result: dictionary of the best epoch, its validation and test MSE,
+            the number of epochs run and the time spent
+    """
+    config = dict(DEFAULTS, **config)
+    if config['threads'] > 0:
+        torch.set_num_threads(config['threads'])
+    torch.manual_seed(config['seed'])
+    if splits is None:
+        splits = make_splits(load_series(config['table']), config['win_size'],
+                             config['val_frac'], config['test_frac'])
+    train_data, val_data, test_data = splits
+
+    model = build_model(config['model'], train_data.shape[2],
+                        config['hidden_size'], train_data.shape[2],
+                        config['num_layers'], config['win_size'] - 1)
+    criterion = torch.nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=config['lr'])
+    state = {'config': config, 'epoch': -1, 'best_val': float('inf'),
+             'best_epoch': -1, 'best_model': None, 'train_time': 0.0}
+
+    saved = checkpointer.load() if checkpointer is not None and resume else None
+    if saved is not None:
+        # the budget of a run may change, the other settings should not
+        budget = ['epochs', 'patience', 'threads']
+        if any(saved['config'].get(k) != config[k] for k in config
+               if k not in budget):
+            print('Warning: resuming a run with another config')
+        model.load_state_dict(saved['model'])
+        optimizer.load_state_dict(saved['optimizer'])
+        torch.set_rng_state(saved['rng'])
+        state.update({k: saved[k] for k in ['epoch', 'best_val', 'best_epoch',
+                                             'best_model', 'train_time']})
+        if verbose:
+            print('Resumed from epoch {}'.format(state['epoch']))
+
+    train_loader = BatchLoader(train_data, config['batch_size'])
+    # the validation buffers and order are reused by every epoch
+    val_loader = BatchLoader(val_data, 256, shuffle=False)
+    for epoch in range(state['epoch'] + 1, config['epochs']):
+        if epoch - state['best_epoch'] > config['patience']:
+            break
+        st = time.time()
+        # the shuffling of an epoch only depends on the seed, for resuming
+        train_loader.rng = np.random.default_rng((config['seed'], epoch))
+        model.train()
+        total_loss = 0
+        for batch_data in train_loader:
+            optimizer.zero_grad()
+            loss = criterion(batch_data[:, -1], model(batch_data[:, :-1]))
+            total_loss += loss.detach() * len(batch_data)
+            loss.backward()
+            optimizer.step()
+
+        val_mse = evaluate(model, val_loader)
+        state['train_time'] += time.time() - st
+        state['epoch'] = epoch
+        best = val_mse < state['best_val'] - config['min_delta']
+        if best:
+            state['best_val'], state['best_epoch'] = val_mse, epoch
+            state['best_model'] = copy.deepcopy(model.state_dict())
+        if verbose:
+            print("Epoch: %d, loss: %1.5f, val MSE: %1.5f%s" % (
+                epoch, total_loss.item() / len(train_data), val_mse,
+                ' *' if best else ''))
+        if checkpointer is not None:
+            checkpointer.save(dict(state, model=model.state_dict(),
+                                   optimizer=optimizer.state_dict(),
+                                   rng=torch.get_rng_state()), best)
+
+    if state['best_model'] is not None:
+        model.load_state_dict(state['best_model'])
+    return {'best_epoch': state['best_epoch'], 'val_mse': state['best_val'],
+            'test_mse': evaluate(model, BatchLoader(test_data, 256,
+                                                    shuffle=False)),
+            'epochs_run': state['epoch'] + 1,
+            'train_time': state['train_time']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default=None,
+                        help='json file of settings, overridden by the options')
+    parser.add_argument('--out', type=str, default='run',
+                        help='folder of the checkpoints and the results')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint in --out')
+    parser.add_argument('--table', type=str, help='table to train on')
+    parser.add_argument('--model', type=str, choices=MODELS, help='the model')
+    for key in ['hidden_size', 'num_layers', 'win_size', 'batch_size',
+                'epochs', 'patience', 'seed', 'threads']:
+        parser.add_argument('--' + key.replace('_', '-'), type=int)
+    for key in ['lr', 'min_delta', 'val_frac', 'test_frac']:
+        parser.add_argument('--' + key.replace('_', '-'), type=float)
+    args = parser.parse_args()
+
+    config = dict(DEFAULTS)
+    if args.config is not None:
+        with open(args.config, 'r') as fp:
+            config.update(json.load(fp))
+    config.update({k: v for k, v in vars(args).items()
+                   if k in DEFAULTS and v is not None})
+
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, 'config.json'), 'w') as fp:
+        json.dump(config, fp, indent=4)
+
+    checkpointer = Checkpointer(args.out)
+    try:
+        result = train(config, checkpointer=checkpointer, resume=args.resume)
+    finally:
+        checkpointer.close()
+    print('Best epoch: {best_epoch}, val MSE: {val_mse:.5f}, '
+          'test MSE: {test_mse:.5f}, {epochs_run} epochs in '
+          '{train_time:.1f}s'.format(**result))
+    with open(os.path.join(args.out, 'result.json'), 'w') as fp:
+        json.dump(result, fp, indent=4)
+
+
+if __name__ == "__main__":
+    main()
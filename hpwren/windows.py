@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Sliding windows of a time series as strided views of the series.
+# A window only gets copied when a batch of windows is drawn, instead of
+# stacking win_size shifted copies of the whole series up front.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class WindowedSeries:
+    """
+    Windows data[t-win_size:t] for t in range(win_size, len(data)), i.e., the
+    windows built by the former sliding_window functions
+
+    The first win_size-1 samples of a window are the input x and the last one
+    is the target y.
+
+    Args:
+        data: the series, (T, num_features)
+        win_size: number of samples per window
+        index: start of each window in data, None means all windows
+    """
+
+    def __init__(self, data, win_size, index=None):
+        self.data = np.asarray(data)
+        self.win_size = win_size
+        num_windows = max(len(self.data) - win_size, 0)
+        if index is None:
+            index = np.arange(num_windows)
+        self.index = np.asarray(index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def all_windows(self):
+        """View of every window of data, (T-win_size+1, win_size, num_features)"""
+        return sliding_window_view(self.data, self.win_size,
+                                   axis=0).swapaxes(1, 2)
+
+    def _contiguous(self):
+        index = self.index
+        return index[-1] - index[0] + 1 == len(index) and \
+            np.all(np.diff(index) == 1)
+
+    @property
+    def windows(self):
+        """
+        The windows, (len(self), win_size, num_features), a view without copy
+        unless the index is not a contiguous range
+        """
+        if not len(self.index):
+            return np.empty((0, self.win_size) + self.data.shape[1:],
+                            dtype=self.data.dtype)
+        if self._contiguous():
+            return self.all_windows[self.index[0]:self.index[-1] + 1]
+        return self.all_windows[self.index]
+
+    @property
+    def x(self):
+        """Input of each window, (len(self), win_size-1, num_features)"""
+        return self.windows[:, :-1]
+
+    @property
+    def y(self):
+        """Target of each window, (len(self), num_features)"""
+        return self.windows[:, -1]
+
+    def batch(self, idx):
+        """
+        Copy the windows idx (positions in this series) into new arrays
+
+        Returns:
+            x, y: contiguous arrays of the inputs and targets
+        """
+        rows = self.index[idx][..., None] + np.arange(self.win_size)
+        windows = self.data[rows]
+        return windows[:, :-1], windows[:, -1]
+
+    def subset(self, idx):
+        """Series of the windows idx, sharing the same data"""
+        return WindowedSeries(self.data, self.win_size, self.index[idx])
+
+    def split(self, num_first):
+        """Split the windows in the first num_first and the rest"""
+        return self.subset(slice(None, num_first)), \
+            self.subset(slice(num_first, None))
+
+    def tensor(self):
+        """
+        The windows as a torch tensor viewing the data, without copy when the
+        index is a contiguous range
+        """
+        import torch
+        if not len(self.index):
+            return torch.from_numpy(self.windows)
+        data = torch.from_numpy(np.ascontiguousarray(self.data))
+        windows = data.unfold(0, self.win_size, 1).permute(0, 2, 1)
+        if self._contiguous():
+            return windows[self.index[0]:self.index[-1] + 1]
+        return windows[torch.from_numpy(self.index)]
@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import argparse
+import os
+import sys
+
 import numpy as np
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 import matplotlib.pyplot as plt
 
+# scatter_report.py of the parent folder is shared with gas_array_drift/read_gas.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								os.pardir))
+from scatter_report import finish_figure, render_report, scatter_classes
+
 ###############################################
 # Data import functions
 ###############################################
@@ -50,9 +59,11 @@ def get_cmap(n, name='hsv'):
 	distinct
     RGB color; the keyword argument name must be a standard mpl colormap name.
 	"""
-	return plt.cm.get_cmap(name, n + 2)
+	return plt.get_cmap(name, n + 2)
 
-def plot_data(x, y, plot_3d=False, title='', fig_name=''):
+
+def plot_data(x, y, plot_3d=False, title='', fig_name='',
+		max_points=None, rasterized=False, dpi=300, show=True):
 	"""
 	Plot scatter plot of the first 2/3 channels of x, with diff colors
 	indicating diff classes, i.e., y
@@ -63,88 +74,64 @@ def plot_data(x, y, plot_3d=False, title='', fig_name=''):
 		plot_3d: if True, plot first 3 channels, else, plot first 2 channels
 		title: title of plot, '' means no title
 		fig_name: the name of the figure to be saved, '' means do not save
+		max_points: if more samples, plot a random subset of max_points
+		rasterized: if True, draw the points as images in vector formats
+		dpi: resolution of the saved figure
+		show: if False, close the figure instead of showing it
 	"""
-	scatter_size = 20
-
-	fig = plt.figure()
-	cmap = get_cmap(cat_cnt)
-	if plot_3d:
-		ax = fig.add_subplot(111, projection='3d')  # 3-D
-	else:
-		ax = fig.add_subplot(111)  # 2-D
-	for i in range(cat_cnt):
-		mask = (y == i)
-		if plot_3d:
-			# z = np.arange(len(mask))[mask] # get the time index
-			ax.scatter(x[mask, 0], x[mask, 1], x[mask, 2], alpha=0.8,
-					   color=cmap(i), s=scatter_size, label=str(i))  # 3-D
-		else:
-			ax.scatter(x[mask, 0], x[mask, 1], alpha=0.8, color=cmap(i),
-					   s=scatter_size, label=str(i))  # 2-D
-	ax.set_xlabel('Attribute 0', fontsize=15)
-	ax.set_ylabel('Attribute 1', fontsize=15)
-	ax.tick_params(labelsize=15)
-	if title != '':
-		ax.set_title(title, fontsize=15)
-	fig.legend()
-	plt.grid()
-	plt.tight_layout()
-
-	if fig_name != '':
-		plt.savefig(fig_name, dpi=300, bbox_inches='tight')
-	plt.show()
+	_plot_classes(x, y, 'Attribute', plot_3d, title, fig_name, max_points,
+				  rasterized, dpi, show)
 
 
-def pca_plot_data(x, y, plot_3d=False, title='', fig_name=''):
+def pca_plot_data(x, y, plot_3d=False, title='', fig_name='',
+		max_points=None, rasterized=False, dpi=300, show=True):
 	"""
 	Plot scatter plot of the first 2/3 channels of x after PCA,
 	with diff colors indicating diff classes, i.e., y
 
-	Args:
-		x: samples, (num_samples, num_features)
-		y: labels, (num_samples,)
-		plot_3d: if True, plot first 3 channels, else, plot first 2 channels
-		title: title of plot, '' means no title
-		fig_name: the name of the figure to be saved, '' means do not save
+	Args: as plot_data
 	"""
 	from sklearn.decomposition import PCA
-	scatter_size = 20
 
 	pca = PCA(n_components=3)
 	pc_x = pca.fit_transform(x)
 	print('explained_variance_ratio_: {}'.format(pca.explained_variance_ratio_))
+	_plot_classes(pc_x, y, 'Principal Component', plot_3d, title, fig_name,
+				  max_points, rasterized, dpi, show)
 
-	# scatter plot
-	fig = plt.figure()
+
+def _plot_classes(x, y, axis_name, plot_3d, title, fig_name, max_points,
+				  rasterized, dpi, show):
+	# the 26 letters in the colors of a colormap, labeled by their index
 	cmap = get_cmap(cat_cnt)
+	fig = plt.figure()
 	if plot_3d:
 		ax = fig.add_subplot(111, projection='3d')  # 3-D
 	else:
-		ax = fig.add_subplot(111)
-	for i in range(cat_cnt):
-		mask = (y == i)
-		if plot_3d:
-			# z = np.arange(len(mask))[mask] # get the time index
-			ax.scatter(pc_x[mask, 0], pc_x[mask, 1], pc_x[mask, 2], alpha=0.8,
-					   color=cmap(i), s=scatter_size, label=str(i))  # 3-D
-		else:
-			ax.scatter(pc_x[mask, 0], pc_x[mask, 1], alpha=0.8, color=cmap(i),
-					   s=scatter_size, label=str(i))  # 2-D
-	ax.set_xlabel('Principal Component 0', fontsize=15)
-	ax.set_ylabel('Principal Component 1', fontsize=15)
+		ax = fig.add_subplot(111)  # 2-D
+	scatter_classes(ax, x, y, [cmap(i) for i in range(cat_cnt)],
+					[str(i) for i in range(cat_cnt)], max_points, rasterized)
+	ax.set_xlabel(axis_name + ' 0', fontsize=15)
+	ax.set_ylabel(axis_name + ' 1', fontsize=15)
 	ax.tick_params(labelsize=15)
 	if title != '':
 		ax.set_title(title, fontsize=15)
 	fig.legend()
 	plt.grid()
 	plt.tight_layout()
-
-	if fig_name != '':
-		plt.savefig(fig_name, dpi=300, bbox_inches='tight')
-	plt.show()
+	finish_figure(fig, fig_name, dpi, show)
 
 
 def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--report', type=str, default=None,
+						help='render the figures of all the training and test '
+							 'samples into this folder instead of showing '
+							 'the first 100')
+	parser.add_argument('--processes', type=int, default=None,
+						help='number of processes rendering the report')
+	args = parser.parse_args()
+
 	# read training data
 	X_train, y_train = read_isolet('isolet1+2+3+4.data')
 	print(X_train.shape, y_train.shape)
@@ -157,6 +144,16 @@ def main():
 	print(X_test.shape, y_test.shape)
 	X_test = scaler.transform(X_test)
 
+	if args.report is not None:
+		figures = []
+		for split, x, y in [('train', X_train, y_train),
+							('test', X_test, y_test)]:
+			figures += [(split, plot_data, (x, y), {'title': split}),
+						(split + '_pca', pca_plot_data, (x, y),
+						 {'title': split})]
+		render_report(figures, args.report, processes=args.processes)
+		return
+
 	##########################################
 	# Scatter plots
 	##########################################
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Scatter plots of labeled samples and their batch rendering into a report
+# folder, shared by gas_array_drift/read_gas.py and isolet/read_data.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def subsample(max_points, *arrays):
+	"""
+	Keep the same random max_points rows of arrays, in their order, all rows if
+	max_points is None or not smaller
+
+	Returns:
+		arrays: tuple of the subsets
+	"""
+	n = len(arrays[0])
+	if max_points is None or n <= max_points:
+		return arrays
+	idx = np.random.default_rng(0).choice(n, max_points, replace=False)
+	idx.sort()
+	return tuple(a[idx] for a in arrays)
+
+
+def scatter_classes(ax, x, y, colors, labels=None, max_points=None,
+		rasterized=False, scatter_size=20):
+	"""
+	Scatter the first 2 or 3 columns of x, one color per class of y
+
+	Args:
+		ax: 2-D or 3-D axes, 3 columns are plotted on 3-D axes
+		x: samples, (num_samples, num_features)
+		y: labels, (num_samples,), in 0, ..., len(colors)-1
+		colors: color of each class
+		labels: legend label of each class, None for no labels
+		max_points: if more samples, plot a random subset of max_points, the
+			same subset for the same number of samples
+		rasterized: if True, draw the points as images in vector formats such
+			as pdf, the axes and text stay vectors (not supported by 3-D axes)
+	"""
+	dims = 3 if ax.name == '3d' else 2
+	rasterized = rasterized and dims == 2
+	x, y = subsample(max_points, x[:, :dims], y)
+	for i, color in enumerate(colors):
+		mask = (y == i)
+		ax.scatter(*x[mask].T, alpha=0.8, color=color, s=scatter_size,
+				   label=None if labels is None else labels[i],
+				   rasterized=rasterized)
+
+
+def finish_figure(fig, fig_name='', dpi=300, show=True):
+	"""Save a figure if fig_name is not '', then show or close it"""
+	if fig_name != '':
+		fig.savefig(fig_name, dpi=dpi, bbox_inches='tight')
+	if show:
+		plt.show()
+	else:
+		plt.close(fig)
+
+
+###############################################
+# Batch rendering
+###############################################
+def _init_renderer():
+	# draw with the non-interactive Agg backend, no window is ever opened
+	plt.switch_backend('Agg')
+
+
+def _render(plot, args, kwargs):
+	plot(*args, **kwargs)
+	return kwargs['fig_name']
+
+
+def render_report(figures, out_dir='report', fmt='png', dpi=150,
+				  max_points=5000, processes=None):
+	"""
+	Render figures in parallel worker processes into a report directory,
+	without showing them, and write an index.html of the figures
+
+	Args:
+		figures: list of (name, plot function, args, kwargs), e.g.,
+			('train', plot_data, (x, y), {'title': 'train'}), the plot
+			functions take fig_name, dpi, max_points, rasterized and show
+		out_dir: folder of the figures
+		fmt: format of the figures, e.g., 'png', or 'pdf' for vector figures
+			with rasterized points
+		dpi: resolution of the figures
+		max_points: plot a random subset of max_points samples of larger
+			sets, None to plot all
+		processes: number of processes, the number of CPUs if None
+	Returns:
+		paths: paths of the figures
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	with ProcessPoolExecutor(processes, initializer=_init_renderer) as pool:
+		futures = [pool.submit(_render, plot, args, dict(
+			kwargs, fig_name=os.path.join(out_dir, name + '.' + fmt), dpi=dpi,
+			max_points=max_points, rasterized=True, show=False))
+			for name, plot, args, kwargs in figures]
+		paths = [future.result() for future in futures]
+
+	with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+		f.write('<html><body>\n')
+		for (name, _, _, _), path in zip(figures, paths):
+			f.write('<h3>{0}</h3>\n<a href="{1}"><img src="{1}" width="640">'
+					'</a>\n'.format(name, os.path.basename(path)))
+		f.write('</body></html>\n')
+	print('{} figures saved to {}'.format(len(paths), out_dir))
+	return paths